@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Cost of the nginx-side authorization check with and without the compact
+auth record, using the Python reference verifier (which reads Redis exactly
+as the Lua module does).
+
+    python benchmarks/bench_auth_record.py [iterations]
+
+Without the record a check is a GET of the signature key, then SMEMBERS of
+the groups key and a scan; with it, a single HMGET.  The group checked for
+is the last one added, and "commands" and "bytes_out" are per check.
+"""
+
+from __future__ import print_function
+import sys
+
+from common import make_redis, server_counters, counter_deltas, run_timed, \
+    print_table
+import flask
+from flask_resty_shared_session import RestySharedSession
+from flask_resty_shared_session.verifier import SessionVerifier
+
+GROUP_COUNTS = (1, 10, 100, 1000)
+
+
+def make_session(redis, group_ids):
+    app = flask.Flask(__name__)
+    app.secret_key = 'bench secret key'
+    app.session_cookie_name = 'bench_session'
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis
+    app.config['SESSION_PERMANENT'] = False
+    app.config['SESSION_KEY_PREFIX'] = 'bench'
+    app.config['SESSION_AUTH_RECORD'] = True
+    RestySharedSession(app)
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        flask.session['groups'] = group_ids
+        return 'ok'
+
+    response = app.test_client().post('/login')
+    cookie = response.headers['Set-Cookie'].split(';')[0]
+    return cookie[cookie.index('=') + 1:]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    redis = make_redis()
+    rows = []
+    for group_count in GROUP_COUNTS:
+        group_ids = ['group-%i' % i for i in range(group_count)]
+        cookie = make_session(redis, group_ids)
+        for auth_record in (False, True):
+            verifier = SessionVerifier(redis, 'bench',
+                                       auth_record=auth_record)
+            assert verifier.authorize(cookie, group_ids[-1])
+            before = server_counters(redis)
+            result = run_timed(
+                lambda: verifier.authorize(cookie, group_ids[-1]), iterations)
+            deltas = counter_deltas(before, server_counters(redis),
+                                    iterations)
+            rows.append({
+                'groups': group_count,
+                'lookup': 'auth record' if auth_record else 'signature+groups',
+                'ops_per_sec': result['ops_per_sec'],
+                'p50_us': result['p50_us'],
+                'p99_us': result['p99_us'],
+                'commands': deltas['commands_per_req'],
+                'bytes_out': deltas['bytes_out_per_req'],
+            })
+    print_table(rows, ['groups', 'lookup', 'ops_per_sec', 'p50_us', 'p99_us',
+                       'commands', 'bytes_out'])
+
+
+if __name__ == '__main__':
+    main()
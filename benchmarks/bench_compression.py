@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""CPU cost against bytes saved for each available session compressor.
+
+    python benchmarks/bench_compression.py [iterations]
+
+Every shape from bench_serializers.py, plus a large one, is encoded with
+the JSON serializer and each compressor (threshold 0, so everything is
+compressed).  Times are per encode/decode, including serialization.
+"""
+
+from __future__ import print_function
+import sys
+
+from common import run_timed, print_table
+from bench_serializers import session_shapes
+from flask_resty_shared_session.serializers import (
+    SessionSerializer, ZlibCompressor, Lz4Compressor, ZstdCompressor,
+    get_compressor
+)
+
+
+def large_shape():
+    data = dict(session_shapes()[2][1])
+    data['history'] = [
+        {'path': '/products/%i' % i, 'seen_at': 1500000000 + i * 37}
+        for i in range(1000)
+    ]
+    return 'large', data
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rows = []
+    for shape_name, data in session_shapes() + [large_shape()]:
+        plain = SessionSerializer('json')
+        raw_size = len(plain.dumps(data))
+        for cls in (None, ZlibCompressor, Lz4Compressor, ZstdCompressor):
+            if cls is not None:
+                try:
+                    get_compressor(cls.name)
+                except ValueError:
+                    continue
+            compression = cls.name if cls is not None else None
+            serializer = SessionSerializer('json', compression, 0)
+            stored = serializer.dumps(data)
+            encode = run_timed(lambda: serializer.dumps(data), iterations)
+            decode = run_timed(lambda: serializer.loads(stored), iterations)
+            rows.append({
+                'shape': shape_name,
+                'compression': compression or 'none',
+                'bytes': len(stored),
+                'saved_pct': 100.0 * (raw_size - len(stored)) / raw_size,
+                'encode_p50_us': encode['p50_us'],
+                'decode_p50_us': decode['p50_us'],
+            })
+    print_table(rows, ['shape', 'compression', 'bytes', 'saved_pct',
+                       'encode_p50_us', 'decode_p50_us'])
+
+
+if __name__ == '__main__':
+    main()
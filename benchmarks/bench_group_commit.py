@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Compare per-request save pipelines with group commit, for saves made by
+many threads at once (as under a threaded WSGI server).
+
+    python benchmarks/bench_group_commit.py [saves_per_thread]
+"""
+
+from __future__ import print_function
+import json
+import sys
+import threading
+import time
+import uuid
+
+from common import (
+    make_redis, server_counters, counter_deltas, percentile, print_table
+)
+from flask_resty_shared_session.sessions import (
+    RedisSessionInterface, SessionWrite
+)
+
+
+def make_write():
+    data = {'username': 'someone@example.com',
+            'groups': ['group-%i' % i for i in range(5)]}
+    return SessionWrite(
+        sid=str(uuid.uuid4()), ttl=3600,
+        data=json.dumps(data),
+        signature=b'2ry_1nUJrss4mv3hF63oUsN3kxs',
+        groups=frozenset(data['groups'])
+    )
+
+
+def run_threads(save, thread_count, saves_per_thread):
+    """Save from `thread_count` threads at once; return saves/sec and save
+    latency percentiles (in microseconds)."""
+    timings = []
+    lock = threading.Lock()
+    start = threading.Event()
+
+    def worker():
+        write = make_write()
+        thread_timings = []
+        start.wait()
+        for _ in range(saves_per_thread):
+            t0 = time.time()
+            save(write)
+            thread_timings.append(time.time() - t0)
+        with lock:
+            timings.extend(thread_timings)
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    started = time.time()
+    start.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    timings.sort()
+    return {
+        'ops_per_sec': len(timings) / elapsed if elapsed else 0.0,
+        'p50_us': percentile(timings, 0.50) * 1e6,
+        'p99_us': percentile(timings, 0.99) * 1e6,
+    }
+
+
+def bench(redis, group_commit, window, thread_count, saves_per_thread):
+    interface = RedisSessionInterface(redis, 'bench',
+                                      group_commit=group_commit,
+                                      group_commit_window=window)
+    if group_commit:
+        save = interface.writer.submit
+    else:
+        save = interface._execute_write
+    before = server_counters(redis)
+    result = run_threads(save, thread_count, saves_per_thread)
+    saves = thread_count * saves_per_thread
+    result.update(counter_deltas(before, server_counters(redis), saves))
+    result['mode'] = 'group commit' if group_commit else 'per request'
+    result['window_ms'] = window * 1000 if group_commit else None
+    result['threads'] = thread_count
+    result['saves_per_round_trip'] = 1.0
+    if group_commit:
+        interface.writer.close()
+        result['saves_per_round_trip'] = \
+            float(saves) / interface.writer.counters.get('batches')
+    return result
+
+
+def main():
+    saves_per_thread = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    redis = make_redis()
+    rows = []
+    for thread_count in (1, 8, 32):
+        for group_commit, window in ((False, 0), (True, 0), (True, 0.001)):
+            rows.append(bench(redis, group_commit, window, thread_count,
+                              saves_per_thread))
+    print_table(rows, ['mode', 'window_ms', 'threads', 'ops_per_sec', 'p50_us', 'p99_us',
+                       'saves_per_round_trip', 'commands_per_req'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Replacing the whole groups key in a pipeline vs. letting the save script
+diff it against the stored members, for sessions with large group
+memberships where one group changes per save.
+
+    python benchmarks/bench_group_updates.py [iterations]
+"""
+
+from __future__ import print_function
+import sys
+import uuid
+
+from common import make_redis, net_input_bytes, run_timed, print_table
+from flask_resty_shared_session.sessions import (
+    RedisSessionInterface, SessionWrite
+)
+
+
+def make_writes(sid, group_count):
+    """Two writes that alternate one group in and out of the set."""
+    base = frozenset('group-%i' % i for i in range(group_count - 1))
+    return [SessionWrite(sid, 3600, groups=base | frozenset([extra]))
+            for extra in ('group-b', 'group-a')]
+
+
+def bench(redis, use_save_script, group_count, iterations):
+    interface = RedisSessionInterface(redis, 'bench',
+                                      use_save_script=use_save_script)
+    sid = str(uuid.uuid4())
+    writes = make_writes(sid, group_count)
+    interface._execute_write(writes[1])
+    state = {'i': 0}
+
+    def save():
+        interface._execute_write(writes[state['i'] % 2])
+        state['i'] += 1
+
+    bytes_before = net_input_bytes(redis)
+    result = run_timed(save, iterations)
+    result['bytes_per_save'] = \
+        float(net_input_bytes(redis) - bytes_before) / iterations
+    result['mode'] = 'script' if use_save_script else 'pipeline'
+    result['groups_update'] = 'diff' if use_save_script else 'replace'
+    result['groups'] = group_count
+    return result
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    redis = make_redis()
+    rows = []
+    for group_count in (10, 500, 5000):
+        for use_save_script in (False, True):
+            rows.append(bench(redis, use_save_script, group_count,
+                              iterations))
+    print_table(rows, ['mode', 'groups', 'groups_update', 'ops_per_sec',
+                       'p50_us', 'p99_us', 'bytes_per_save'])
+
+
+if __name__ == '__main__':
+    main()
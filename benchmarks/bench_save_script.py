@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Compare the pipelined session save with the single Lua script save.
+
+    python benchmarks/bench_save_script.py [iterations]
+"""
+
+from __future__ import print_function
+import json
+import sys
+import uuid
+
+from common import make_redis, net_input_bytes, run_timed, print_table
+from flask_resty_shared_session.sessions import (
+    RedisSessionInterface, SessionWrite
+)
+
+
+def make_write(group_count):
+    data = {'username': 'someone@example.com',
+            'groups': ['group-%i' % i for i in range(group_count)]}
+    return SessionWrite(
+        sid=str(uuid.uuid4()), ttl=3600,
+        data=json.dumps(data),
+        signature=b'2ry_1nUJrss4mv3hF63oUsN3kxs',
+        groups=frozenset(data['groups'])
+    )
+
+
+def bench(redis, use_save_script, group_count, iterations):
+    interface = RedisSessionInterface(redis, 'bench',
+                                      use_save_script=use_save_script)
+    write = make_write(group_count)
+    interface._execute_write(write)
+    bytes_before = net_input_bytes(redis)
+    result = run_timed(lambda: interface._execute_write(write), iterations)
+    result['mode'] = 'script' if use_save_script else 'pipeline'
+    result['groups'] = group_count
+    result['bytes_per_save'] = \
+        float(net_input_bytes(redis) - bytes_before) / iterations
+    return result
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    redis = make_redis()
+    rows = []
+    for group_count in (0, 5, 100):
+        for use_save_script in (False, True):
+            rows.append(bench(redis, use_save_script, group_count, iterations))
+    print_table(rows, ['mode', 'groups', 'ops_per_sec', 'p50_us', 'p99_us',
+                       'bytes_per_save'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Encode/decode time and stored size of each available session format.
+
+    python benchmarks/bench_serializers.py [iterations]
+"""
+
+from __future__ import print_function
+import sys
+
+from common import run_timed, print_table
+from flask_resty_shared_session.serializers import (
+    SessionSerializer, JSONSerializer, OrjsonSerializer, MsgpackSerializer,
+    get_serializer
+)
+
+
+def session_shapes():
+    auth = {
+        '_permanent': True,
+        'username': 'someone@example.com',
+        'groups': ['group-one', 'group-two', 'group-three'],
+    }
+    preferences = dict(auth)
+    preferences.update({
+        'groups': ['group-%i' % i for i in range(50)],
+        'preferences': dict(('pref_%i' % i, i % 3 == 0) for i in range(40)),
+        'csrf_token': 'a' * 40,
+    })
+    cart = dict(auth)
+    cart['cart'] = [
+        {'sku': 'SKU-%06i' % i, 'quantity': i % 5 + 1,
+         'price': 9.99 + i, 'title': 'Some product title %i' % i}
+        for i in range(200)
+    ]
+    return [('auth', auth), ('preferences', preferences), ('cart', cart)]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rows = []
+    for shape_name, data in session_shapes():
+        for cls in (JSONSerializer, OrjsonSerializer, MsgpackSerializer):
+            try:
+                get_serializer(cls.name)
+            except ValueError:
+                continue
+            serializer = SessionSerializer(cls.name)
+            stored = serializer.dumps(data)
+            encode = run_timed(lambda: serializer.dumps(data), iterations)
+            decode = run_timed(lambda: serializer.loads(stored), iterations)
+            rows.append({
+                'shape': shape_name,
+                'format': cls.name,
+                'bytes': len(stored),
+                'encode_p50_us': encode['p50_us'],
+                'decode_p50_us': decode['p50_us'],
+            })
+    print_table(rows, ['shape', 'format', 'bytes', 'encode_p50_us',
+                       'decode_p50_us'])
+
+
+if __name__ == '__main__':
+    main()
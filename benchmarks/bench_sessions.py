@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Per-request overhead of open_session/save_session, driven through
+Flask's test client.
+
+    python benchmarks/bench_sessions.py [--iterations N]
+        [--backend redislite|fakeredis] [--set SESSION_OPTION=VALUE ...]
+        [--output results.json] [--compare baseline.json]
+
+Each scenario (read-only request, modifying request, login) runs for every
+combination of session payload size and group count.  Results include
+ops/sec, latency percentiles, and (on redislite) Redis commands and bytes
+per request.  ``--output`` writes them as JSON; ``--compare`` prints the
+change against an earlier JSON result, e.g. one taken on another commit.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import platform
+import subprocess
+import sys
+
+from common import (
+    ROOT_DIR, make_redis, server_counters, counter_deltas, run_timed,
+    print_table
+)
+import flask
+from flask_resty_shared_session import RestySharedSession
+from flask_resty_shared_session.version import VERSION
+
+PAYLOAD_SIZES = (('small', 100), ('medium', 2048), ('large', 32768))
+GROUP_COUNTS = (0, 10, 500)
+SCENARIOS = ('read', 'write', 'login')
+
+
+def make_payload(size):
+    return {'items': ['item-%06i' % i for i in range(size // 13)]}
+
+
+def make_app(redis, session_config, payload, group_ids):
+    app = flask.Flask(__name__)
+    app.secret_key = 'bench secret key'
+    app.session_cookie_name = 'bench_session'
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis
+    app.config['SESSION_PERMANENT'] = False
+    app.config['SESSION_KEY_PREFIX'] = 'bench'
+    app.config.update(session_config)
+    RestySharedSession(app)
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        flask.current_app.session_interface.regenerate(flask.session)
+        flask.session['username'] = 'someone@example.com'
+        flask.session['groups'] = group_ids
+        flask.session['payload'] = payload
+        return 'ok'
+
+    @app.route('/read')
+    def read():
+        return flask.session.get('username', '')
+
+    @app.route('/write', methods=['POST'])
+    def write():
+        flask.session['counter'] = flask.session.get('counter', 0) + 1
+        return 'ok'
+
+    return app
+
+
+def run_scenario(redis, session_config, scenario, size, group_count,
+                 iterations):
+    group_ids = ['group-%i' % i for i in range(group_count)]
+    app = make_app(redis, session_config, make_payload(size), group_ids)
+    client = app.test_client()
+    client.post('/login')
+    request = {
+        'read': lambda: client.get('/read'),
+        'write': lambda: client.post('/write'),
+        'login': lambda: client.post('/login'),
+    }[scenario]
+    request()
+
+    before = server_counters(redis)
+    result = run_timed(request, iterations)
+    result.update(counter_deltas(before, server_counters(redis), iterations))
+    return result
+
+
+def parse_option(text):
+    name, _, value = text.partition('=')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return name, value
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR
+        ).decode('utf8').strip()
+    except Exception:
+        return None
+
+
+def scenario_key(result):
+    return '%s/%s/%s' % (result['scenario'], result['size'], result['groups'])
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = dict((scenario_key(r), r) for r in json.load(f)['results'])
+    rows = []
+    for result in results:
+        old = baseline.get(scenario_key(result))
+        if old is None:
+            continue
+        row = {'scenario': scenario_key(result)}
+        if old['ops_per_sec']:
+            row['ops_ratio'] = result['ops_per_sec'] / old['ops_per_sec']
+        if old['p99_us']:
+            row['p99_ratio'] = result['p99_us'] / old['p99_us']
+        if (result['commands_per_req'] is not None
+                and old['commands_per_req'] is not None):
+            row['commands_delta'] = \
+                result['commands_per_req'] - old['commands_per_req']
+        rows.append(row)
+    print_table(rows, ['scenario', 'ops_ratio', 'p99_ratio',
+                       'commands_delta'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--backend', choices=('redislite', 'fakeredis'),
+                        default='redislite')
+    parser.add_argument('--set', dest='options', action='append', default=[],
+                        metavar='SESSION_OPTION=VALUE',
+                        help='extra app config, e.g. SESSION_SAVE_SCRIPT=true')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', metavar='BASELINE_JSON')
+    args = parser.parse_args()
+
+    if args.backend == 'fakeredis':
+        import fakeredis
+        redis = fakeredis.FakeStrictRedis()
+    else:
+        redis = make_redis()
+    session_config = dict(parse_option(o) for o in args.options)
+
+    results = []
+    for scenario in SCENARIOS:
+        for size_name, size in PAYLOAD_SIZES:
+            for group_count in GROUP_COUNTS:
+                result = run_scenario(redis, session_config, scenario, size,
+                                      group_count, args.iterations)
+                result.update(scenario=scenario, size=size_name,
+                              groups=group_count)
+                results.append(result)
+
+    print_table(results, ['scenario', 'size', 'groups', 'ops_per_sec',
+                          'p50_us', 'p99_us', 'commands_per_req',
+                          'bytes_in_per_req'])
+    if args.output:
+        document = {
+            'meta': {
+                'revision': git_revision(),
+                'version': VERSION,
+                'python': platform.python_version(),
+                'backend': args.backend,
+                'iterations': args.iterations,
+                'session_config': session_config,
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    if args.compare:
+        print()
+        print_comparison(results, args.compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
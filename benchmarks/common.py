@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+from __future__ import print_function
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def make_redis():
+    """A throwaway redislite server for a benchmark run."""
+    import redislite
+    db_path = os.path.join(tempfile.mkdtemp(prefix='resty_session_bench'),
+                           'bench.db')
+    return redislite.StrictRedis(db_path)
+
+
+def net_input_bytes(redis):
+    return int(redis.info('stats')['total_net_input_bytes'])
+
+
+def server_counters(redis):
+    """Commands processed and bytes exchanged so far, or ``None`` if the
+    server doesn't report them (e.g. fakeredis)."""
+    try:
+        stats = redis.info('stats')
+        return {
+            'commands': int(stats['total_commands_processed']),
+            'bytes_in': int(stats['total_net_input_bytes']),
+            'bytes_out': int(stats['total_net_output_bytes']),
+        }
+    except Exception:
+        return None
+
+
+def counter_deltas(before, after, requests):
+    """Per-request deltas between two :func:`server_counters` results.
+    The INFO call made to take `after` is not counted."""
+    if before is None or after is None:
+        return dict((name, None) for name in
+                    ('commands_per_req', 'bytes_in_per_req',
+                     'bytes_out_per_req'))
+    return {
+        'commands_per_req':
+            float(after['commands'] - before['commands'] - 1) / requests,
+        'bytes_in_per_req':
+            float(after['bytes_in'] - before['bytes_in']) / requests,
+        'bytes_out_per_req':
+            float(after['bytes_out'] - before['bytes_out']) / requests,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def run_timed(func, iterations):
+    """Call `func` `iterations` times; return ops/sec and latency percentiles
+    (in microseconds)."""
+    timings = []
+    started = time.time()
+    for _ in range(iterations):
+        t0 = time.time()
+        func()
+        timings.append(time.time() - t0)
+    elapsed = time.time() - started
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / elapsed if elapsed else 0.0,
+        'p50_us': percentile(timings, 0.50) * 1e6,
+        'p90_us': percentile(timings, 0.90) * 1e6,
+        'p99_us': percentile(timings, 0.99) * 1e6,
+        'p999_us': percentile(timings, 0.999) * 1e6,
+    }
+
+
+def print_table(rows, columns):
+    lines = [list(columns)]
+    for row in rows:
+        cells = []
+        for col in columns:
+            value = row.get(col, '')
+            if value is None:
+                value = '-'
+            elif isinstance(value, float):
+                value = '%.1f' % value
+            cells.append(str(value))
+        lines.append(cells)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(columns))]
+    for line in lines:
+        print('  '.join(cell.rjust(width) for cell, width in zip(line, widths)))
@@ -11,6 +11,10 @@ from .version import VERSION
 __version__ = VERSION
 
 from .sessions import NullSessionInterface, RedisSessionInterface
+from .cache import SessionCache
+from .metrics import MetricsSink, PrometheusTextSink
+from .response_cache import GroupResponseCache
+from .group_versions import GroupVersions
 
 
 class RestySharedSession(object):
@@ -62,12 +66,92 @@ class RestySharedSession(object):
         config.setdefault('SESSION_USE_SIGNER', True)
         config.setdefault('SESSION_KEY_PREFIX', 'resty_shared_session')
         config.setdefault('SESSION_REDIS', None)
+        config.setdefault('SESSION_REDIS_URL', None)
+        config.setdefault('SESSION_REDIS_MAX_CONNECTIONS', None)
+        config.setdefault('SESSION_REDIS_SOCKET_TIMEOUT', None)
+        config.setdefault('SESSION_REDIS_SOCKET_CONNECT_TIMEOUT', None)
+        config.setdefault('SESSION_REDIS_SOCKET_KEEPALIVE', None)
+        config.setdefault('SESSION_REDIS_HEALTH_CHECK_INTERVAL', None)
+        config.setdefault('SESSION_SKIP_EMPTY', False)
+        config.setdefault('SESSION_SAVE_SCRIPT', False)
+        config.setdefault('SESSION_CACHE_SIZE', 0)
+        config.setdefault('SESSION_CACHE_MAX_BYTES', 4 * 1024 * 1024)
+        config.setdefault('SESSION_CACHE_TTL', 30)
+        config.setdefault('SESSION_SERIALIZER', 'json')
+        config.setdefault('SESSION_METRICS', None)
+        config.setdefault('SESSION_GROUP_INDEX', False)
+        config.setdefault('SESSION_KEY_HASH_TAGS', False)
+        config.setdefault('SESSION_READ_REDIS', None)
+        config.setdefault('SESSION_READ_STICKY_SECONDS', 5)
+        config.setdefault('SESSION_LAZY', False)
+        config.setdefault('SESSION_HASH_FIELDS', False)
+        config.setdefault('SESSION_HOT_FIELDS', None)
+        config.setdefault('SESSION_COMPRESSION', None)
+        config.setdefault('SESSION_COMPRESS_THRESHOLD', 1024)
+        config.setdefault('SESSION_TTL_REFRESH_INTERVAL', None)
+        config.setdefault('SESSION_AUTH_RECORD', False)
+        config.setdefault('SESSION_DEFERRED_WRITES', False)
+        config.setdefault('SESSION_DEFERRED_QUEUE_SIZE', 10000)
+        config.setdefault('SESSION_DEFERRED_WORKERS', 1)
+        config.setdefault('SESSION_GROUP_COMMIT', False)
+        config.setdefault('SESSION_GROUP_COMMIT_WINDOW', 0)
+        config.setdefault('SESSION_GROUP_COMMIT_MAX_BATCH', 64)
+        config.setdefault('SESSION_WARM_UP_CONNECTIONS', 0)
 
         if config['SESSION_TYPE'] == 'redis':
+            if config['SESSION_REDIS'] is None:
+                config['SESSION_REDIS'] = self._get_redis(config)
             session_interface = RedisSessionInterface(
                 config['SESSION_REDIS'], config['SESSION_KEY_PREFIX'],
-                config['SESSION_USE_SIGNER'], config['SESSION_PERMANENT'])
+                config['SESSION_USE_SIGNER'], config['SESSION_PERMANENT'],
+                skip_empty=config['SESSION_SKIP_EMPTY'],
+                use_save_script=config['SESSION_SAVE_SCRIPT'],
+                cache=self._get_cache(config),
+                serializer=config['SESSION_SERIALIZER'],
+                metrics=config['SESSION_METRICS'],
+                group_index=config['SESSION_GROUP_INDEX'],
+                key_hash_tags=config['SESSION_KEY_HASH_TAGS'],
+                read_redis=config['SESSION_READ_REDIS'],
+                read_sticky_seconds=config['SESSION_READ_STICKY_SECONDS'],
+                lazy=config['SESSION_LAZY'],
+                hash_fields=config['SESSION_HASH_FIELDS'],
+                hot_fields=config['SESSION_HOT_FIELDS'],
+                compression=config['SESSION_COMPRESSION'],
+                compress_threshold=config['SESSION_COMPRESS_THRESHOLD'],
+                ttl_refresh_interval=config['SESSION_TTL_REFRESH_INTERVAL'],
+                auth_record=config['SESSION_AUTH_RECORD'],
+                deferred_writes=config['SESSION_DEFERRED_WRITES'],
+                deferred_queue_size=config['SESSION_DEFERRED_QUEUE_SIZE'],
+                deferred_workers=config['SESSION_DEFERRED_WORKERS'],
+                group_commit=config['SESSION_GROUP_COMMIT'],
+                group_commit_window=config['SESSION_GROUP_COMMIT_WINDOW'],
+                group_commit_max_batch=config['SESSION_GROUP_COMMIT_MAX_BATCH'],
+                warm_up_connections=config['SESSION_WARM_UP_CONNECTIONS'])
         else:
             session_interface = NullSessionInterface()
 
         return session_interface
+
+    def _get_redis(self, config):
+        from redis import Redis
+        options = {}
+        for option in ('max_connections', 'socket_timeout',
+                       'socket_connect_timeout', 'socket_keepalive',
+                       'health_check_interval'):
+            # unset options keep redis-py's defaults; some (like keepalive)
+            # aren't accepted at all for unix sockets
+            value = config['SESSION_REDIS_' + option.upper()]
+            if value is not None:
+                options[option] = value
+        if config['SESSION_REDIS_URL'] is not None:
+            return Redis.from_url(config['SESSION_REDIS_URL'], **options)
+        return Redis(**options)
+
+    def _get_cache(self, config):
+        if not config['SESSION_CACHE_SIZE']:
+            return None
+        return SessionCache(
+            config['SESSION_REDIS'], '%s:invalidate' % config['SESSION_KEY_PREFIX'],
+            max_entries=config['SESSION_CACHE_SIZE'],
+            max_bytes=config['SESSION_CACHE_MAX_BYTES'],
+            ttl=config['SESSION_CACHE_TTL'])
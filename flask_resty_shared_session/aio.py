@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""An asyncio counterpart of :class:`RedisSessionInterface`, for frameworks
+with awaitable session interfaces such as Quart.  Requires Python 3 and
+``redis>=4.2`` (for ``redis.asyncio``).
+
+Sessions use the same key layout and signature format as the synchronous
+interface, so the OpenResty ``resty.shared_session`` module reads them
+unchanged.
+"""
+
+from timeit import default_timer
+from redis.exceptions import NoScriptError
+
+from .sessions import RedisSessionInterface
+from .scripts import save_session_script
+
+
+class AsyncRedisSessionInterface(RedisSessionInterface):
+    """Uses the Redis key-value store as a session backend, without blocking
+    the event loop.
+
+    :param redis: A ``redis.asyncio.Redis`` instance.
+    :param key_prefix: A prefix that is added to all Redis store keys.
+    :param use_signer: Whether to sign the session id cookie or not.
+    :param permanent: Whether to use permanent session or not.
+    :param skip_empty: Whether to skip storing (and setting a cookie for)
+                       new sessions until something is written to them.
+    :param use_save_script: Whether to save sessions atomically in a single
+                            server-side Lua script instead of a pipeline.
+    :param serializer: The name of the format session data is written in.
+    :param metrics: An optional :class:`~.metrics.MetricsSink` that session
+                    operations are reported to.
+    :param compression: The name of a compressor applied to stored values of
+                        at least `compress_threshold` bytes.
+    :param compress_threshold: The smallest value size, in bytes, that is
+                               compressed.
+    """
+
+    def __init__(self, redis, key_prefix, use_signer=True, permanent=True,
+                 skip_empty=False, use_save_script=False, serializer=None,
+                 metrics=None, compression=None, compress_threshold=1024):
+        if redis is None:
+            from redis.asyncio import Redis
+            redis = Redis()
+        RedisSessionInterface.__init__(
+            self, redis, key_prefix, use_signer, permanent,
+            skip_empty=skip_empty, use_save_script=use_save_script,
+            serializer=serializer, metrics=metrics, compression=compression,
+            compress_threshold=compress_threshold)
+
+    async def open_session(self, app, request):
+        if self.metrics is None:
+            return await self._open_session(app, request)
+        started = default_timer()
+        try:
+            return await self._open_session(app, request)
+        finally:
+            self.metrics.timing('open_session', default_timer() - started)
+
+    async def _open_session(self, app, request):
+        if self.use_signer and not app.secret_key:
+            return None
+        sid, signature = self._unsign_cookie(app, request)
+        if sid is None:
+            return self._new_session()
+        value = await self._load_data(sid)
+        return self._make_session(sid, signature, value)
+
+    async def _load_data(self, sid, use_primary=False):
+        self._incr('redis_round_trips')
+        return await self.redis.get(self._get_redis_data_key(sid))
+
+    async def regenerate(self, session):
+        if session.sid:
+            await self._delete_session(session.sid)
+        session.sid = self._generate_sid()
+        session.forget_stored()
+
+    async def destroy(self, session):
+        if session.sid:
+            await self._delete_session(session.sid)
+        session.sid = None
+
+    async def _delete_session(self, sid, group_ids=()):
+        self._incr('redis_round_trips')
+        await self.redis.delete(*self._get_all_session_keys(sid))
+
+    async def save_session(self, app, session, response):
+        if self.metrics is None:
+            return await self._save_session(app, session, response)
+        started = default_timer()
+        try:
+            return await self._save_session(app, session, response)
+        finally:
+            self.metrics.timing('save_session', default_timer() - started)
+
+    async def _save_session(self, app, session, response):
+        write = self._prepare_save(app, session, response)
+        if write:
+            await self._execute_write(write)
+            self._mark_saved(session, write)
+
+    async def _execute_write(self, write):
+        self._incr('redis_round_trips')
+        if write.data is not None:
+            self._observe('session_bytes', len(write.data))
+        if self.use_save_script:
+            keys, args = self._get_save_script_keys_and_args(write)
+            try:
+                await self.redis.evalsha(save_session_script.sha, len(keys),
+                                         *(keys + args))
+            except NoScriptError:
+                await self.redis.eval(save_session_script.source, len(keys),
+                                      *(keys + args))
+            return
+        pipeline = self.redis.pipeline()
+        self._add_write_to_pipeline(pipeline, write)
+        await pipeline.execute()
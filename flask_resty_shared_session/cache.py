@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+from itsdangerous import want_bytes
+
+from .stats import Counters
+
+
+class SessionCache(object):
+    """A bounded, process-local LRU of stored session values.
+
+    Entries are the raw values stored under ``<prefix>:data:<sid>``, so the
+    memory held is bounded by ``max_bytes`` (payload plus sid bytes) and by
+    ``max_entries``.  Each entry lives for at most ``ttl`` seconds.
+
+    Writers publish the sids they change on a Redis pub/sub channel, and a
+    background thread evicts those sids in every other process.  The cache
+    is only used while that subscription is live: if it drops, the cache is
+    cleared and bypassed until the listener has resubscribed.
+
+    An invalidation can arrive while a miss is still being read from Redis,
+    before there is an entry to drop.  So every discard is numbered, and a
+    fill passes the :meth:`fill_token` taken before its read to :meth:`set`,
+    which skips the value if the sid was invalidated in between.
+
+    :param redis: A ``redis.Redis`` instance used for pub/sub.
+    :param channel: The invalidation channel name.
+    :param max_entries: The maximum number of cached sessions.
+    :param max_bytes: The maximum number of cached bytes.
+    :param ttl: The maximum age of a cached entry, in seconds.
+    """
+
+    reconnect_delay = 1.0
+
+    def __init__(self, redis, channel, max_entries=1024,
+                 max_bytes=4 * 1024 * 1024, ttl=30):
+        self.redis = redis
+        self.channel = channel
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.counters = Counters()
+        self._origin = want_bytes(uuid4().hex)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._subscribed = threading.Event()
+        self._listener = None
+        self._reset_generations()
+
+    def _reset_generations(self):
+        self._generation = 0
+        # sid -> generation of its last discard, for the most recent ones
+        self._discarded = OrderedDict()
+        # fills that started before this may have missed a discard
+        self._forgotten_generation = 0
+
+    def fill_token(self):
+        """Take before reading a value that will be passed to :meth:`set`."""
+        with self._lock:
+            return self._generation
+
+    def _is_stale(self, sid, token):
+        return token < self._forgotten_generation or \
+            self._discarded.get(sid, token) > token
+
+    def get(self, sid):
+        if not self._ensure_listener():
+            self.counters.incr('misses')
+            return None
+        with self._lock:
+            entry = self._entries.pop(sid, None)
+            if entry is not None:
+                if entry[1] > time.time():
+                    # re-inserting moves the entry to the MRU end
+                    self._entries[sid] = entry
+                else:
+                    self._bytes -= self._entry_size(sid, entry[0])
+                    self.counters.incr('expirations')
+                    entry = None
+        if entry is None:
+            self.counters.incr('misses')
+            return None
+        self.counters.incr('hits')
+        return entry[0]
+
+    def set(self, sid, value, token=None):
+        """Cache `value`; with a `token` from :meth:`fill_token`, only if
+        `sid` wasn't invalidated since the token was taken."""
+        if not self._ensure_listener():
+            return
+        size = self._entry_size(sid, value)
+        with self._lock:
+            if token is not None and self._is_stale(sid, token):
+                self.counters.incr('stale_fills_skipped')
+                return
+            old = self._entries.pop(sid, None)
+            if old is not None:
+                self._bytes -= self._entry_size(sid, old[0])
+            if size > self.max_bytes:
+                return
+            self._entries[sid] = (value, time.time() + self.ttl)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                old_sid, (old_value, _) = self._entries.popitem(last=False)
+                self._bytes -= self._entry_size(old_sid, old_value)
+                self.counters.incr('evictions')
+
+    def discard(self, sid):
+        with self._lock:
+            entry = self._entries.pop(sid, None)
+            if entry is not None:
+                self._bytes -= self._entry_size(sid, entry[0])
+            self._generation += 1
+            self._discarded.pop(sid, None)
+            self._discarded[sid] = self._generation
+            while len(self._discarded) > self.max_entries:
+                _, generation = self._discarded.popitem(last=False)
+                self._forgotten_generation = generation
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation += 1
+            self._discarded.clear()
+            self._forgotten_generation = self._generation
+
+    def reset_after_fork(self):
+        """Forget everything inherited from the parent process: its entries
+        and its subscription, which only delivered invalidations there.
+        Sibling workers also need origins of their own, or they would
+        ignore each other's invalidations."""
+        self._origin = want_bytes(uuid4().hex)
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+        self._listener = None
+        self._reset_generations()
+        self.clear()
+
+    def invalidate(self, client, sid):
+        """Drop `sid` here and, through `client`, in every other process.
+
+        `client` may be a pipeline, so that the PUBLISH rides along with
+        the write that made the invalidation necessary.
+        """
+        self.discard(sid)
+        client.publish(self.channel, self._origin + b' ' + want_bytes(sid))
+
+    def stats(self):
+        stats = self.counters.snapshot()
+        with self._lock:
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        return stats
+
+    @staticmethod
+    def _entry_size(sid, value):
+        return len(sid) + len(value)
+
+    def start_listener(self):
+        """Subscribe to invalidations now rather than on first use."""
+        self._ensure_listener()
+
+    def _ensure_listener(self):
+        if self._listener is None or not self._listener.is_alive():
+            with self._lock:
+                if self._listener is None or not self._listener.is_alive():
+                    self._listener = threading.Thread(
+                        target=self._listen,
+                        name='resty-session-cache-invalidation')
+                    self._listener.daemon = True
+                    self._listener.start()
+        return self._subscribed.is_set()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self._on_message(message)
+            except Exception:
+                self.counters.incr('listener_errors')
+            self._subscribed.clear()
+            self.clear()
+            time.sleep(self.reconnect_delay)
+
+    def _on_message(self, message):
+        if message['type'] == 'subscribe':
+            # anything cached before now may have missed invalidations
+            self.clear()
+            self._subscribed.set()
+            return
+        if message['type'] != 'message':
+            return
+        origin, _, sid = want_bytes(message['data']).partition(b' ')
+        if origin == self._origin:
+            return
+        self.discard(sid.decode('utf8'))
+        self.counters.incr('invalidations')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Per-group version counters, for invalidating a group's cached resources
+without purging anything.
+
+Every write to a group's resources bumps the group's counter, and every
+cache key (or ETag) for those resources includes the current value.
+After a bump, old entries are simply never asked for again and age out on
+their own.  The nginx side builds the same keys with
+``shared_session:versioned_cache_key``.
+"""
+
+import functools
+
+import flask
+
+from .sessions import str_fmt, returns_bytes
+
+
+class AppRedisClient(object):
+    """Base class for helpers that use the current application's session
+    Redis connection and key prefix unless given their own."""
+
+    def __init__(self, redis=None, key_prefix=None):
+        self.redis = redis
+        self.key_prefix = key_prefix
+
+    def _get_redis(self):
+        if self.redis is not None:
+            return self.redis
+        return flask.current_app.session_interface.redis
+
+    def _get_key_prefix(self):
+        if self.key_prefix is not None:
+            return self.key_prefix
+        return flask.current_app.session_interface.key_prefix
+
+
+class GroupVersions(AppRedisClient):
+    """Version counters kept in ``<prefix>:group_version:<group_id>``.
+    Groups that were never bumped are at version 0.
+
+    :param redis: A ``redis.Redis`` instance; by default the session
+                  interface's.
+    :param key_prefix: A prefix for counter keys; by default the session
+                       key prefix.
+    """
+
+    @returns_bytes
+    def _get_version_key(self, group_id):
+        return str_fmt('%s:group_version:%s', self._get_key_prefix(),
+                       group_id)
+
+    def get(self, group_id):
+        return int(self._get_redis().get(self._get_version_key(group_id))
+                   or 0)
+
+    def get_many(self, group_ids):
+        """Return a dict of the versions of `group_ids`, with one MGET."""
+        group_ids = list(group_ids)
+        if not group_ids:
+            return {}
+        values = self._get_redis().mget(
+            [self._get_version_key(group_id) for group_id in group_ids])
+        return dict((group_id, int(value or 0))
+                    for group_id, value in zip(group_ids, values))
+
+    def bump(self, group_id):
+        """Invalidate everything cached for `group_id`; returns the new
+        version."""
+        return self._get_redis().incr(self._get_version_key(group_id))
+
+    def cache_key(self, group_id, base_key, version=None):
+        """`base_key` with the group's current version appended, in the same
+        form as the Lua module's ``versioned_cache_key``."""
+        if version is None:
+            version = self.get(group_id)
+        return '%s:v%i' % (base_key, version)
+
+    def stamp(self, response, group_id, version=None):
+        """Fold the group's version into `response`'s ETag (setting one if
+        there is none) and answer conditional requests with a 304."""
+        if version is None:
+            version = self.get(group_id)
+        etag, _ = response.get_etag()
+        if etag is None:
+            etag = str(group_id)
+        response.set_etag('%s.v%i' % (etag, version))
+        return response.make_conditional(flask.request)
+
+    def bumps(self, group_arg='group_id'):
+        """Decorate a view that modifies the resources of the group in its
+        `group_arg` URL argument; its version is bumped after every response
+        with a status below 400."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                response = flask.make_response(view(*args, **kwargs))
+                if response.status_code < 400:
+                    self.bump(kwargs[group_arg])
+                return response
+            return wrapper
+        return decorator
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Instrumentation for session operations.
+
+A session interface reports to its ``metrics`` sink, if it has one:
+
+* ``timing('open_session' | 'save_session', seconds)``
+* ``incr(name)`` for ``redis_round_trips``, ``new_sessions``,
+  ``signature_failures``, ``cache_hits``, ``cache_misses``,
+  ``replica_reads``, ``replica_misses`` and ``ttl_refreshes``
+* ``observe('session_bytes', size)`` for every session value read from or
+  written to Redis
+* ``observe('session_uncompressed_bytes', size)`` for every value that was
+  compressed before it was written
+
+Without a sink (the default) nothing is measured at all.
+"""
+
+import threading
+from bisect import bisect_left
+
+
+class MetricsSink(object):
+    """Base class for metrics sinks; ignores everything it is sent."""
+
+    def timing(self, name, seconds):
+        pass
+
+    def incr(self, name, amount=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+TIMING_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                  0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class PrometheusTextSink(MetricsSink):
+    """Aggregates session metrics in-process and renders them in the
+    Prometheus text exposition format, e.g. from a ``/metrics`` route::
+
+        sink = PrometheusTextSink()
+        app.config['SESSION_METRICS'] = sink
+
+        @app.route('/metrics')
+        def metrics():
+            return sink.render(), 200, {'Content-Type': sink.content_type}
+
+    :param namespace: The prefix of every metric name.
+    """
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, namespace='resty_session'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def timing(self, name, seconds):
+        self._observe(name + '_seconds', seconds, TIMING_BUCKETS)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        self._observe(name, value, SIZE_BUCKETS)
+
+    def _observe(self, name, value, buckets):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                metric = '%s_%s_total' % (self.namespace, name)
+                lines.append('# TYPE %s counter' % metric)
+                lines.append('%s %s' % (metric, self._counters[name]))
+            for name in sorted(self._histograms):
+                histogram = self._histograms[name]
+                metric = '%s_%s' % (self.namespace, name)
+                lines.append('# TYPE %s histogram' % metric)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{le="%s"} %d'
+                                 % (metric, repr(float(bound)), cumulative))
+                lines.append('%s_bucket{le="+Inf"} %d'
+                             % (metric, histogram.count))
+                lines.append('%s_sum %s' % (metric, repr(float(histogram.sum))))
+                lines.append('%s_count %d' % (metric, histogram.count))
+        return '\n'.join(lines) + '\n'
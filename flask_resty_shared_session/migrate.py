@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Move stored sessions between the plain and the hash-tagged key layouts.
+
+    python -m flask_resty_shared_session.migrate \\
+        --url redis://127.0.0.1:6379/12 --prefix app_session_prefix \\
+        --to hash-tags [--cluster] [--batch-size 500] [--rate-limit 5000]
+"""
+
+from __future__ import print_function
+import argparse
+import sys
+
+from .sessions import RedisSessionInterface
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Move sessions between the plain and the hash-tagged '
+                    'key layouts.')
+    parser.add_argument('--url', required=True, help='Redis URL')
+    parser.add_argument('--prefix', required=True,
+                        help="the application's SESSION_KEY_PREFIX")
+    parser.add_argument('--to', required=True, choices=('hash-tags', 'plain'),
+                        help='the layout to migrate sessions into')
+    parser.add_argument('--cluster', action='store_true',
+                        help='connect to a Redis Cluster')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--rate-limit', type=int, default=None,
+                        help='maximum sessions per second')
+    args = parser.parse_args(argv)
+
+    if args.cluster:
+        from redis.cluster import RedisCluster
+        redis = RedisCluster.from_url(args.url)
+    else:
+        from redis import StrictRedis
+        redis = StrictRedis.from_url(args.url)
+    interface = RedisSessionInterface(redis, args.prefix,
+                                      key_hash_tags=args.to == 'hash-tags')
+    migrated = interface.migrate_key_layout(batch_size=args.batch_size,
+                                            rate_limit=args.rate_limit)
+    print('migrated %d sessions' % migrated)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
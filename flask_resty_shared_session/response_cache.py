@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Caching of group-scoped responses in Redis, for deployments that don't
+put nginx (and ``resty.shared_session``) in front of the application.
+
+A cached response is shared by every member of the group, exactly like the
+nginx setups described in the README.  Concurrent misses for the same
+response are coalesced: one request takes a short Redis lock and calls the
+view, the others wait for its response to appear in the cache.
+"""
+
+import functools
+import hashlib
+import json
+import time
+from uuid import uuid4
+
+import flask
+from itsdangerous import want_bytes
+
+from .group_versions import AppRedisClient, GroupVersions
+from .scripts import release_lock_script
+from .sessions import (
+    get_group_set, want_str, str_fmt, returns_bytes, text_type
+)
+from .stats import Counters
+
+
+class GroupResponseCache(AppRedisClient):
+    """Caches view responses per group and request URL.
+
+    Use :meth:`cached` to decorate views that take the group id as a URL
+    argument::
+
+        response_cache = GroupResponseCache(timeout=300)
+
+        @app.route('/api/group/<group_id>/report')
+        @response_cache.cached()
+        def group_report(group_id):
+            ...
+
+    Requests whose session isn't a member of the group get a 403.  Only
+    ``GET`` and ``HEAD`` requests answered with a 200 are cached, without
+    their ``Set-Cookie`` headers.
+
+    :param redis: A ``redis.Redis`` instance; by default the session
+                  interface's.
+    :param key_prefix: A prefix for cache keys; by default the session key
+                       prefix.
+    :param timeout: For how many seconds responses are cached.
+    :param lock_timeout: For how many seconds a request filling the cache
+                         holds the lock; a crashed holder delays the others
+                         by at most this long.
+    :param poll_interval: How often, in seconds, waiting requests check for
+                          the response.
+    :param versioned: Whether to include the group's
+                      :class:`~.group_versions.GroupVersions` version in
+                      cache keys, so that bumping it invalidates the group's
+                      cached responses.  Costs one more GET per request.
+    """
+
+    def __init__(self, redis=None, key_prefix=None, timeout=300,
+                 lock_timeout=10, poll_interval=0.05, versioned=False):
+        AppRedisClient.__init__(self, redis, key_prefix)
+        self.versions = None
+        if versioned:
+            self.versions = GroupVersions(redis, key_prefix)
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.counters = Counters()
+
+    def cached(self, group_arg='group_id', timeout=None):
+        """Decorate a view whose `group_arg` URL argument is the group id.
+
+        :param timeout: Overrides the cache's timeout for this view.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                group_id = kwargs[group_arg]
+                if group_text(group_id) not in self._get_session_groups():
+                    flask.abort(403)
+                if flask.request.method not in ('GET', 'HEAD'):
+                    return view(*args, **kwargs)
+                return self._get_or_fill(group_id,
+                                         lambda: view(*args, **kwargs),
+                                         timeout or self.timeout)
+            return wrapper
+        return decorator
+
+    def _get_session_groups(self):
+        return frozenset(group_text(group_id) for group_id
+                         in get_group_set(flask.session))
+
+    @returns_bytes
+    def _get_response_key(self, group_id):
+        url_hash = hashlib.sha1(want_bytes(flask.request.full_path))
+        key = str_fmt('%s:response:%s:%s', self._get_key_prefix(), group_id,
+                      url_hash.hexdigest())
+        if self.versions is not None:
+            key = self.versions.cache_key(group_id, key)
+        return key
+
+    def _get_or_fill(self, group_id, call_view, timeout):
+        redis = self._get_redis()
+        key = self._get_response_key(group_id)
+        lock_key = key + b':lock'
+        deadline = time.time() + self.lock_timeout
+        while True:
+            value = redis.get(key)
+            if value is not None:
+                self.counters.incr('hits')
+                return load_response(value)
+            token = uuid4().hex
+            if redis.set(lock_key, token, nx=True,
+                         px=int(self.lock_timeout * 1000)):
+                break
+            if time.time() >= deadline:
+                # the holder is taking too long; don't wait any longer
+                self.counters.incr('lock_timeouts')
+                return flask.make_response(call_view())
+            self.counters.incr('lock_waits')
+            time.sleep(self.poll_interval)
+
+        self.counters.incr('misses')
+        try:
+            response = flask.make_response(call_view())
+            if response.status_code == 200:
+                redis.set(key, dump_response(response), ex=timeout)
+        finally:
+            release_lock_script(redis, [lock_key], [token])
+        return response
+
+
+def group_text(group_id):
+    """Return `group_id` as text, as it is stored in the groups key (which
+    nginx checks), so that e.g. a group ``7`` matches the URL's ``'7'``."""
+    return text_type(want_str(group_id))
+
+
+def dump_response(response):
+    headers = [(name, value) for name, value in response.headers
+               if name.lower() != 'set-cookie']
+    head = json.dumps({'status': response.status_code, 'headers': headers})
+    return want_bytes(head) + b'\n' + response.get_data()
+
+
+def load_response(value):
+    head, _, body = value.partition(b'\n')
+    head = json.loads(head.decode('utf8'))
+    return flask.current_app.response_class(
+        body, status=head['status'], headers=head['headers'])
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+import hashlib
+import threading
+import weakref
+from itsdangerous import want_bytes
+from redis.exceptions import NoScriptError
+
+
+class RedisScript(object):
+    """A Lua script called with EVALSHA.
+
+    The script is loaded once per connection pool; if the server later
+    answers NOSCRIPT (e.g. after a restart or SCRIPT FLUSH), the call falls
+    back to EVAL, which also caches the script on the server again.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.sha = hashlib.sha1(want_bytes(source)).hexdigest()
+        self._lock = threading.Lock()
+        self._loaded_pools = weakref.WeakKeyDictionary()
+
+    def load(self, redis):
+        # cluster clients have no single pool; they load on every primary
+        pool = getattr(redis, 'connection_pool', redis)
+        if pool in self._loaded_pools:
+            return
+        with self._lock:
+            if pool not in self._loaded_pools:
+                redis.script_load(self.source)
+                self._loaded_pools[pool] = True
+
+    def __call__(self, redis, keys, args):
+        self.load(redis)
+        keys_and_args = list(keys) + list(args)
+        try:
+            return redis.evalsha(self.sha, len(keys), *keys_and_args)
+        except NoScriptError:
+            return redis.eval(self.source, len(keys), *keys_and_args)
+
+
+# KEYS: data, groups, signature[, auth]
+# ARGV: ttl,
+#       data_changed, data,
+#       signature_changed, signature,
+#       groups_changed[, group_count, group ids...]
+#
+# Unchanged keys only get their TTL refreshed.  A changed groups key is
+# brought to the given set by diffing it against its stored members, so
+# it converges even when overlapping saves started from different sets,
+# only the differences are written, and readers never see it empty.  A
+# fourth key, the auth record, gets the same treatment: its field "" holds
+# the signature and its other fields are the group ids.
+SAVE_SESSION_LUA = """
+local ttl = tonumber(ARGV[1])
+
+if ARGV[2] == '1' then
+    redis.call('SET', KEYS[1], ARGV[3], 'EX', ttl)
+else
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+
+if ARGV[4] == '1' then
+    redis.call('SET', KEYS[3], ARGV[5], 'EX', ttl)
+else
+    redis.call('EXPIRE', KEYS[3], ttl)
+end
+
+local function each_chunk(command, key, values)
+    -- chunks have an even length, so HSET pairs are never split
+    for i = 1, #values, 1000 do
+        redis.call(command, key,
+                   unpack(values, i, math.min(i + 999, #values)))
+    end
+end
+
+-- returns the values of `target` missing from `stored`, and the values of
+-- `stored` (except `keep`) missing from `target`
+local function diff(target, stored, keep)
+    local missing = {}
+    for value in pairs(target) do
+        missing[value] = true
+    end
+    local extra = {}
+    for _, value in ipairs(stored) do
+        if missing[value] then
+            missing[value] = nil
+        elseif value ~= keep then
+            extra[#extra + 1] = value
+        end
+    end
+    local added = {}
+    for value in pairs(missing) do
+        added[#added + 1] = value
+    end
+    return added, extra
+end
+
+local groups_changed = ARGV[6] == '1'
+local groups = {}
+if groups_changed then
+    for i = 8, 7 + tonumber(ARGV[7]) do
+        groups[ARGV[i]] = true
+    end
+    local added, removed = diff(groups, redis.call('SMEMBERS', KEYS[2]))
+    each_chunk('SADD', KEYS[2], added)
+    each_chunk('SREM', KEYS[2], removed)
+end
+redis.call('EXPIRE', KEYS[2], ttl)
+
+if KEYS[4] then
+    local fields = {}
+    if ARGV[4] == '1' then
+        fields = {'', ARGV[5]}
+    end
+    if groups_changed then
+        groups[''] = nil
+        local added, removed = diff(groups, redis.call('HKEYS', KEYS[4]),
+                                    '')
+        for _, group_id in ipairs(added) do
+            fields[#fields + 1] = group_id
+            fields[#fields + 1] = '1'
+        end
+        each_chunk('HDEL', KEYS[4], removed)
+    end
+    each_chunk('HSET', KEYS[4], fields)
+    redis.call('EXPIRE', KEYS[4], ttl)
+end
+return 1
+"""
+
+save_session_script = RedisScript(SAVE_SESSION_LUA)
+
+
+def get_save_session_args(write):
+    """Build the ARGV list for :data:`save_session_script`."""
+    args = [write.ttl]
+    for value in (write.data, write.signature):
+        if value is None:
+            args.extend([0, b''])
+        else:
+            args.extend([1, value])
+    if write.groups is None:
+        args.append(0)
+    else:
+        args.extend([1, len(write.groups)])
+        args.extend(write.groups)
+    return args
+
+
+# KEYS: lock
+# ARGV: token
+#
+# Deletes the lock only if it is still held with `token`, i.e. it hasn't
+# expired and been taken by someone else in the meantime.
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+release_lock_script = RedisScript(RELEASE_LOCK_LUA)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Session data serializers.
+
+JSON values are stored bare, exactly as earlier versions stored them, and
+can be produced by either the stdlib ``json`` module or ``orjson``.  Other
+formats are stored behind a two-byte header: ``TAG_MARKER`` (a byte no JSON
+document starts with) followed by the format's tag.  A reader therefore
+decodes every registered format regardless of which one it writes, so the
+format of a live cluster can be switched without dropping sessions.
+
+Values above a size threshold can also be compressed.  A compressed value
+is ``TAG_MARKER``, the compressor's tag, and then the compressed form of
+the complete uncompressed value (which carries its own format header, if
+any).  Compressed and plain values coexist in the same way formats do.
+"""
+
+import json
+import zlib
+from itsdangerous import want_bytes
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+TAG_MARKER = b'\x00'
+
+
+class JSONSerializer(object):
+    name = 'json'
+    tag = None
+
+    def dumps(self, data):
+        return want_bytes(json.dumps(data, separators=(',', ':')))
+
+    def loads(self, payload):
+        return json.loads(bytes(payload).decode('utf8'))
+
+
+class OrjsonSerializer(object):
+    name = 'orjson'
+    tag = None
+
+    def dumps(self, data):
+        return orjson.dumps(data)
+
+    def loads(self, payload):
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # e.g. NaN, written by a process using the stdlib json module
+            return json.loads(bytes(payload).decode('utf8'))
+
+
+class MsgpackSerializer(object):
+    name = 'msgpack'
+    tag = b'm'
+
+    def dumps(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+class ZlibCompressor(object):
+    name = 'zlib'
+    tag = b'z'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, payload):
+        return zlib.compress(payload, self.level)
+
+    def decompress(self, payload):
+        return zlib.decompress(payload)
+
+
+class Lz4Compressor(object):
+    name = 'lz4'
+    tag = b'4'
+
+    def compress(self, payload):
+        return lz4.frame.compress(payload)
+
+    def decompress(self, payload):
+        return lz4.frame.decompress(payload)
+
+
+class ZstdCompressor(object):
+    name = 'zstd'
+    tag = b's'
+
+    def __init__(self, level=3):
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, payload):
+        return self.compressor.compress(payload)
+
+    def decompress(self, payload):
+        return self.decompressor.decompress(payload)
+
+
+_serializers = {}
+_tagged_serializers = {}
+_compressors = {}
+_tagged_compressors = {}
+
+
+def register_serializer(serializer):
+    """Make `serializer` available for writing (by name) and reading (by
+    tag).  Tags are single bytes; ``None`` means bare JSON."""
+    _serializers[serializer.name] = serializer
+    if serializer.tag is not None:
+        _tagged_serializers[serializer.tag] = serializer
+
+
+def register_compressor(compressor):
+    """Make `compressor` available for writing (by name) and reading (by
+    tag).  Its tag must not be used by any serializer."""
+    _compressors[compressor.name] = compressor
+    _tagged_compressors[compressor.tag] = compressor
+
+
+def get_serializer(name):
+    try:
+        return _serializers[name]
+    except KeyError:
+        raise ValueError('unknown or unavailable session serializer: %r'
+                         % name)
+
+
+def get_compressor(name):
+    try:
+        return _compressors[name]
+    except KeyError:
+        raise ValueError('unknown or unavailable session compressor: %r'
+                         % name)
+
+
+register_serializer(JSONSerializer())
+if orjson is not None:
+    register_serializer(OrjsonSerializer())
+if msgpack is not None:
+    register_serializer(MsgpackSerializer())
+register_compressor(ZlibCompressor())
+if lz4 is not None:
+    register_compressor(Lz4Compressor())
+if zstandard is not None:
+    register_compressor(ZstdCompressor())
+
+
+class SessionSerializer(object):
+    """Writes session data in one format and reads any registered format.
+
+    :param name: The name of the format to write.
+    :param compression: The name of the compressor applied to values of at
+                        least `compress_threshold` bytes, if any.  Values
+                        that don't get smaller are stored uncompressed.
+    :param compress_threshold: The smallest value size, in bytes, that is
+                               compressed.
+    """
+
+    def __init__(self, name='json', compression=None,
+                 compress_threshold=1024):
+        self.writer = get_serializer(name)
+        # orjson reads integers beyond 64 bits as floats, so JSON the
+        # stdlib module wrote is only read with orjson when asked to
+        if self.writer.name == 'orjson':
+            self.json_reader = self.writer
+        else:
+            self.json_reader = _serializers['json']
+        self.compressor = None
+        if compression is not None:
+            self.compressor = get_compressor(compression)
+        self.compress_threshold = compress_threshold
+
+    def encode(self, data):
+        """Return the stored form of `data`, and its size before
+        compression."""
+        value = self.writer.dumps(data)
+        if self.writer.tag is not None:
+            value = TAG_MARKER + self.writer.tag + value
+        size = len(value)
+        if self.compressor is not None and size >= self.compress_threshold:
+            compressed = self.compressor.compress(value)
+            if len(compressed) + 2 < size:
+                value = TAG_MARKER + self.compressor.tag + compressed
+        return value, size
+
+    def dumps(self, data):
+        return self.encode(data)[0]
+
+    def loads(self, value):
+        value = want_bytes(value)
+        if value[:1] != TAG_MARKER:
+            return self.json_reader.loads(value)
+        tag = value[1:2]
+        compressor = _tagged_compressors.get(tag)
+        if compressor is not None:
+            return self.loads(compressor.decompress(value[2:]))
+        try:
+            reader = _tagged_serializers[tag]
+        except KeyError:
+            raise ValueError('unknown session format tag: %r' % tag)
+        return reader.loads(memoryview(value)[2:])
@@ -6,14 +6,22 @@
 
 # adaptations (c) 2017 by Scott Ivey, also under BSD license.
 
+import os
 import sys
 from uuid import uuid4
-import json
 import functools
+import time
+from timeit import default_timer
 from flask.sessions import SessionInterface as FlaskSessionInterface
 from flask.sessions import SessionMixin
 from werkzeug.datastructures import CallbackDict
-from itsdangerous import Signer, BadSignature, want_bytes
+from itsdangerous import BadSignature, want_bytes
+from redis.exceptions import NoScriptError
+from .stats import Counters
+from .signing import CookieSigner, BoundedCache
+from .scripts import save_session_script, get_save_session_args
+from .serializers import SessionSerializer
+from .writers import DeferredWriter, GroupCommitWriter, weak_method
 
 PY2 = sys.version_info[0] == 2
 if PY2:
@@ -23,6 +31,10 @@ else:
     text_type = str
     bytes_type = bytes
 
+# The auth record field holding the signature; the other fields are the
+# session's group ids (so no group may be called this).
+AUTH_SIGNATURE_FIELD = ''
+
 
 def is_texty(x):
     return isinstance(x, (text_type, bytes_type))
@@ -52,30 +64,343 @@ def str_fmt(fmt, *args):
     return fmt % tuple(fixed_args)
 
 
+def open_connections(redis, count):
+    """Make sure `redis`'s pool holds at least `count` connections, each
+    of which has answered a PING."""
+    pool = getattr(redis, 'connection_pool', None)
+    if pool is None:
+        # cluster clients keep a pool per node
+        redis.ping()
+        return
+    connections = []
+    try:
+        for _ in range(count):
+            try:
+                connection = pool.get_connection()
+            except TypeError:
+                # redis-py before 5.3 wants a command name
+                connection = pool.get_connection('PING')
+            connections.append(connection)
+            connection.send_command('PING')
+            connection.read_response()
+    finally:
+        for connection in connections:
+            pool.release(connection)
+
+
+def is_cluster_client(redis):
+    try:
+        from redis.cluster import RedisCluster
+    except ImportError:
+        return False
+    return isinstance(redis, RedisCluster)
+
+
 def total_seconds(td):
     return td.days * 60 * 60 * 24 + td.seconds
 
 
+def get_group_set(session):
+    group_ids = session.get('groups', None)
+    if not group_ids:
+        return frozenset()
+    return frozenset(group_ids)
+
+
+def get_data_size(value):
+    """The size of a stored session value: bytes or a dict of hash
+    fields."""
+    if isinstance(value, dict):
+        return sum(len(encoded) for encoded in value.values())
+    return len(value)
+
+
+def is_empty_session(session):
+    # `_permanent` is set by the session itself, not by the application
+    for key in session:
+        if key != '_permanent':
+            return False
+    return True
+
+
+class SessionWrite(object):
+    """The set of Redis changes needed to persist one session.
+
+    ``data``, ``signature`` and ``groups`` are ``None`` when the
+    corresponding key is unchanged; unchanged keys only get their TTL
+    refreshed so that all three keys of a session expire together.
+
+    ``groups`` is the complete new group set, and ``previous_groups`` the
+    set the request loaded.  Other requests may have saved the session
+    since, so the groups key is brought to ``groups`` as a whole: the save
+    script diffs it against the stored members, a pipeline replaces it
+    inside MULTI/EXEC.  The auth record follows the groups key, so with
+    ``auth_record`` a write that sets ``groups`` must set ``signature`` too.
+
+    Sessions stored as hashes use ``fields`` (encoded values to HSET) and
+    ``deleted_fields`` (to HDEL) instead of ``data``; ``replaces_fields``
+    drops all other fields first.
+
+    A write with ``refresh`` set is sent even if nothing changed, to reset
+    the TTLs of all keys (e.g. because the cookie's expiry moved forward).
+    """
+
+    __slots__ = ('sid', 'ttl', 'data', 'signature', 'groups',
+                 'previous_groups', 'fields', 'deleted_fields',
+                 'replaces_fields', 'refresh')
+
+    def __init__(self, sid, ttl, data=None, signature=None, groups=None,
+                 previous_groups=frozenset(), fields=None, deleted_fields=(),
+                 replaces_fields=False, refresh=False):
+        self.sid = sid
+        self.ttl = ttl
+        self.data = data
+        self.signature = signature
+        self.groups = groups
+        self.previous_groups = previous_groups
+        self.fields = fields
+        self.deleted_fields = deleted_fields
+        self.replaces_fields = replaces_fields
+        self.refresh = refresh
+
+    @property
+    def data_size(self):
+        if self.fields is not None:
+            return sum(len(value) for value in self.fields.values())
+        if self.data is not None:
+            return len(self.data)
+        return None
+
+    def __bool__(self):
+        return (self.data is not None or self.signature is not None
+                or self.groups is not None or self.fields is not None
+                or bool(self.deleted_fields) or self.replaces_fields
+                or self.refresh)
+
+    __nonzero__ = __bool__
+
+
 class ServerSideSession(CallbackDict, SessionMixin):
-    """Baseclass for server-side based sessions."""
+    """Baseclass for server-side based sessions.
+
+    Besides the usual ``modified`` flag, a session remembers what is
+    already stored in Redis for its sid (``stored_signature`` and
+    ``stored_groups``), so that saving can skip keys that did not change.
+    """
 
-    def __init__(self, initial=None, sid=None, permanent=None):
+    loaded = True
+
+    def __init__(self, initial=None, sid=None, permanent=None, new=False):
         def on_update(self):
             self.modified = True
         CallbackDict.__init__(self, initial, on_update)
         self.sid = sid
         if permanent:
             self.permanent = permanent
+        self.new = new
+        self.modified = False
+        self.stored_signature = None
+        self.stored_groups = frozenset()
+
+    def mark_stored(self, signature, groups):
+        """Record the signature and group set persisted for this sid."""
+        self.new = False
         self.modified = False
+        self.stored_signature = signature
+        self.stored_groups = groups
+
+    def forget_stored(self):
+        """Forget any persisted state, e.g. after the sid has changed."""
+        self.new = True
+        self.modified = True
+        self.stored_signature = None
+        self.stored_groups = frozenset()
+
+    def load(self):
+        """Make sure the session's data has been fetched."""
 
 
 class RedisSession(ServerSideSession):
     pass
 
 
+def _loading(name):
+    method = getattr(RedisSession, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+class LazyRedisSession(RedisSession):
+    """A session whose cookie has been verified, but whose data is only
+    fetched (by calling `loader` with the sid) once it is first used.
+    `loader` returns a fully loaded session, whose contents and state are
+    then taken over.
+    """
+
+    loaded = False
+
+    def __init__(self, sid, loader):
+        RedisSession.__init__(self, sid=sid)
+        self._loader = loader
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        session = self._loader(self.sid)
+        dict.update(self, session)
+        self.new = session.new
+        self.modified = session.modified
+        self.stored_signature = session.stored_signature
+        self.stored_groups = session.stored_groups
+
+
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__',
+              '__iter__', '__len__', '__eq__', '__ne__', '__repr__', 'get',
+              'keys', 'values', 'items', 'setdefault', 'pop', 'popitem',
+              'update', 'clear', 'copy', 'has_key', 'iterkeys', 'itervalues',
+              'iteritems'):
+    if hasattr(dict, _name):
+        setattr(LazyRedisSession, _name, _loading(_name))
+del _name
+
+
+class RedisHashSession(RedisSession):
+    """A session stored as a Redis hash, one field per top-level key.
+
+    Keys changed through the mapping interface are collected in
+    ``dirty_keys``, so that saving only writes those fields.  It is ``None``
+    when every field has to be rewritten, e.g. because the application set
+    ``modified`` by hand after changing a nested value.
+
+    A session opened with only some of its fields (`loaded_keys`, whether
+    or not they were stored) is given a `loader`, which returns all stored
+    fields; it is called the first time any other key (or the session as a
+    whole) is accessed.
+    """
+
+    def __init__(self, initial=None, sid=None, permanent=None, new=False,
+                 loader=None, loaded_keys=()):
+        self._modified = False
+        self.dirty_keys = set()
+        self._loader = loader
+        self._known_keys = set(loaded_keys)
+        RedisSession.__init__(self, initial, sid, permanent, new)
+
+        def on_update(self):
+            self._modified = True
+        self.on_update = on_update
+
+    @property
+    def modified(self):
+        return self._modified
+
+    @modified.setter
+    def modified(self, value):
+        self._modified = value
+        self.dirty_keys = None if value else set()
+
+    def load(self):
+        self.load_fields()
+
+    def load_fields(self):
+        """Fetch the fields that weren't loaded with the session, if any."""
+        loader, self._loader = self._loader, None
+        if loader is None:
+            return
+        for key, value in loader().items():
+            if key not in self._known_keys:
+                dict.__setitem__(self, key, value)
+
+    def _load_field(self, key):
+        if self._loader is not None and key not in self._known_keys:
+            self.load_fields()
+
+    def _touch(self, key):
+        self._known_keys.add(key)
+        if self.dirty_keys is not None:
+            self.dirty_keys.add(key)
+
+    def __setitem__(self, key, value):
+        RedisSession.__setitem__(self, key, value)
+        self._touch(key)
+
+    def __delitem__(self, key):
+        self._load_field(key)
+        RedisSession.__delitem__(self, key)
+        self._touch(key)
+
+    def setdefault(self, key, default=None):
+        self._load_field(key)
+        if not dict.__contains__(self, key):
+            self._touch(key)
+        return RedisSession.setdefault(self, key, default)
+
+    def pop(self, key, *default):
+        self._load_field(key)
+        self._touch(key)
+        return RedisSession.pop(self, key, *default)
+
+    def popitem(self):
+        self.load_fields()
+        item = RedisSession.popitem(self)
+        self._touch(item[0])
+        return item
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        RedisSession.update(self, changes)
+        for key in changes:
+            self._touch(key)
+
+    def clear(self):
+        self.load_fields()
+        keys = list(dict.keys(self))
+        RedisSession.clear(self)
+        for key in keys:
+            self._touch(key)
+
+
+def _loading_field(name):
+    method = getattr(RedisSession, name)
+
+    def wrapper(self, key, *args, **kwargs):
+        self._load_field(key)
+        return method(self, key, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+def _loading_fields(name):
+    method = getattr(RedisSession, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.load_fields()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ('__getitem__', '__contains__', 'get', 'has_key'):
+    if hasattr(dict, _name):
+        setattr(RedisHashSession, _name, _loading_field(_name))
+for _name in ('__iter__', '__len__', '__eq__', '__ne__', '__repr__', 'keys',
+              'values', 'items', 'copy', 'iterkeys', 'itervalues',
+              'iteritems'):
+    if hasattr(dict, _name):
+        setattr(RedisHashSession, _name, _loading_fields(_name))
+del _name
+
+
 
 class SessionInterface(FlaskSessionInterface):
 
+    _cookie_signer = (None, None)
+
     def _generate_sid(self):
         return str(uuid4())
 
@@ -83,8 +408,14 @@ class SessionInterface(FlaskSessionInterface):
         if not app.secret_key:
             return None
         salt = getattr(app, 'session_cookie_salt', 'flask-resty-session')
-        return Signer(app.secret_key, salt=salt,
-                      key_derivation='hmac')
+        # the signer (and its caches) is kept for as long as the secret key
+        # and salt stay the same; rotating either starts from scratch.
+        signer_key = (app.secret_key, salt)
+        cached_key, signer = self._cookie_signer
+        if cached_key != signer_key:
+            signer = CookieSigner(app.secret_key, salt)
+            self._cookie_signer = (signer_key, signer)
+        return signer
 
 
 class NullSessionInterface(SessionInterface):
@@ -119,60 +450,461 @@ class RedisSessionInterface(SessionInterface):
     :param key_prefix: A prefix that is added to all Redis store keys.
     :param use_signer: Whether to sign the session id cookie or not.
     :param permanent: Whether to use permanent session or not.
+    :param skip_empty: Whether to skip storing (and setting a cookie for)
+                       new sessions until something is written to them.
+    :param use_save_script: Whether to save sessions atomically in a single
+                            server-side Lua script instead of a pipeline.
+    :param cache: An optional :class:`~.cache.SessionCache` consulted before
+                  reading session data from Redis.
+    :param serializer: The name of the format session data is written in;
+                       see :mod:`~.serializers`.  Data in any registered
+                       format can be read.
+    :param metrics: An optional :class:`~.metrics.MetricsSink` that session
+                    operations are reported to.
+    :param group_index: Whether to maintain a group -> sessions index, needed
+                        by :meth:`revoke_group` and :meth:`strip_group`.
+    :param key_hash_tags: Whether to wrap the sid in session keys in a
+                          ``{sid}`` hash tag, so that all keys of a session
+                          live in the same Redis Cluster slot.
+    :param read_redis: An optional client (usually connected to a replica)
+                       that session data is read from.  Writes always go to
+                       `redis`.
+    :param read_sticky_seconds: For how long after a write a client's
+                                sessions are read from `redis` instead of
+                                `read_redis`, so it sees its own writes.
+    :param lazy: Whether to fetch session data only when the session is
+                 first used.  Requests that never touch it neither read
+                 nor write Redis (and don't refresh the session cookie).
+    :param hash_fields: Whether to store each top-level session key in its
+                        own field of a Redis hash, so that saves only write
+                        the keys that changed.  Can't be combined with
+                        `cache`, `use_save_script` or `lazy`.
+    :param hot_fields: With `hash_fields`, the keys to read when a session
+                       is opened; the other fields are only fetched when
+                       they are first accessed.  ``_permanent`` and
+                       ``groups`` are always read.  By default all fields
+                       are read.
+    :param compression: The name of a compressor (``zlib``, ``lz4`` or
+                        ``zstd``) applied to stored values of at least
+                        `compress_threshold` bytes; see :mod:`~.serializers`.
+    :param compress_threshold: The smallest value size, in bytes, that is
+                               compressed.
+    :param ttl_refresh_interval: If set, opening a session resets the TTLs of
+                                 its keys, at most once per this many seconds
+                                 (per process), so that sessions only expire
+                                 after `permanent_session_lifetime` without
+                                 requests.  Needs Redis 6.2 (for GETEX).
+    :param auth_record: Whether to also maintain a hash per session holding
+                        its signature and group ids, which lets nginx
+                        authorize a request with a single ``HMGET``.
+    :param deferred_writes: Whether to send session writes to Redis from
+                            background threads (see :mod:`~.writers`)
+                            instead of before the response is returned.
+                            The session cookie is still set right away.
+    :param deferred_queue_size: How many writes each background thread may
+                                have queued before saves start to wait.
+    :param deferred_workers: The number of background writer threads.
+    :param group_commit: Whether to send the writes of concurrent saves to
+                         Redis together, in one pipeline per batch (see
+                         :class:`~.writers.GroupCommitWriter`).  Saves still
+                         wait for their writes.  Can't be combined with
+                         `deferred_writes`.
+    :param group_commit_window: How long, in seconds, a batch waits for more
+                                writes after its first.
+    :param group_commit_max_batch: The most writes sent in one batch.
+    :param warm_up_connections: If set, :meth:`warm_up` opens this many
+                                connections when the interface is created
+                                and again in every forked worker process.
     """
 
-    serializer = json
+    serializer = SessionSerializer()
     session_class = RedisSession
+    #: How many sids the last TTL refresh time is remembered for.
+    ttl_refresh_tracking_size = 16384
+    #: The least time, in seconds, between two saves that only reset the
+    #: TTLs of a session's keys because its cookie was re-sent (per
+    #: process), unless `ttl_refresh_interval` is set; the keys may
+    #: therefore expire this much before the cookie.
+    refresh_save_interval = 60
+    lazy_session_class = LazyRedisSession
 
-    def __init__(self, redis, key_prefix, use_signer=True, permanent=True):
+    def __init__(self, redis, key_prefix, use_signer=True, permanent=True,
+                 skip_empty=False, use_save_script=False, cache=None,
+                 serializer=None, metrics=None, group_index=False,
+                 key_hash_tags=False, read_redis=None, read_sticky_seconds=5,
+                 lazy=False, hash_fields=False, hot_fields=None,
+                 compression=None, compress_threshold=1024,
+                 ttl_refresh_interval=None, auth_record=False,
+                 deferred_writes=False, deferred_queue_size=10000,
+                 deferred_workers=1, group_commit=False,
+                 group_commit_window=0, group_commit_max_batch=64,
+                 warm_up_connections=0):
         if redis is None:
             from redis import Redis
             redis = Redis()
         self.redis = redis
+        self.read_redis = read_redis
+        self.read_sticky_seconds = read_sticky_seconds
+        self.lazy = lazy
+        self.ttl_refresh_interval = ttl_refresh_interval
+        self.auth_record = auth_record
+        self._ttl_refreshed = BoundedCache(self.ttl_refresh_tracking_size)
+        self.hash_fields = hash_fields
+        if hash_fields:
+            if cache is not None or use_save_script or lazy:
+                raise ValueError('hash_fields cannot be combined with a '
+                                 'cache, the save script or lazy loading')
+            self.session_class = RedisHashSession
+        self.hot_fields = None
+        if hot_fields and not hash_fields:
+            raise ValueError('hot_fields needs hash_fields')
+        if hot_fields:
+            self.hot_fields = list(hot_fields)
+            for key in ('_permanent', 'groups'):
+                if key not in self.hot_fields:
+                    self.hot_fields.append(key)
         self.key_prefix = key_prefix
         self.use_signer = use_signer
         self.permanent = permanent
+        self.skip_empty = skip_empty
+        self.use_save_script = use_save_script
+        self.cache = cache
+        if serializer is not None or compression is not None:
+            self.serializer = SessionSerializer(serializer or 'json',
+                                                compression,
+                                                compress_threshold)
+        self.metrics = metrics
+        self.group_index = group_index
+        self.key_hash_tags = key_hash_tags
+        # cluster pipelines can't reliably wrap commands in MULTI/EXEC;
+        # SESSION_SAVE_SCRIPT keeps saves atomic there.
+        self.is_cluster = is_cluster_client(redis)
+        if self.is_cluster and use_save_script and not key_hash_tags:
+            raise ValueError('the save script needs key_hash_tags=True '
+                             'on Redis Cluster')
+        self.counters = Counters()
+        self.writer = None
+        if deferred_writes and group_commit:
+            raise ValueError('deferred_writes and group_commit cannot be '
+                             'combined')
+        if group_commit:
+            self.writer = GroupCommitWriter(
+                self._execute_writes, window=group_commit_window,
+                max_batch=group_commit_max_batch)
+        if deferred_writes:
+            self.writer = DeferredWriter(self._execute_write,
+                                         max_queued=deferred_queue_size,
+                                         workers=deferred_workers)
+        self.warm_up_connections = warm_up_connections
+        self._pid = os.getpid()
+        register_at_fork = getattr(os, 'register_at_fork', None)
+        if register_at_fork is not None:
+            register_at_fork(after_in_child=weak_method(self._check_fork))
+        if warm_up_connections:
+            self._warm_up_safely()
+
+    def _check_fork(self):
+        # forked workers (e.g. gunicorn --preload) inherit the parent's
+        # sockets and cache; on Python 2 this is noticed on the next request
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._after_fork()
+
+    def _after_fork(self):
+        for client in (self.redis, self.read_redis):
+            pool = getattr(client, 'connection_pool', None)
+            if pool is not None:
+                pool.reset()
+        if self.cache is not None:
+            self.cache.reset_after_fork()
+        self.counters.incr('fork_resets')
+        if self.warm_up_connections:
+            self._warm_up_safely()
+
+    def _warm_up_safely(self):
+        # a worker that can't reach Redis yet should still boot
+        try:
+            self.warm_up(self.warm_up_connections)
+        except Exception:
+            self.counters.incr('warm_up_errors')
+
+    def warm_up(self, connections=1):
+        """Open `connections` connections to each Redis server sessions are
+        read from or written to, and load the save script (if used), so
+        that a worker's first requests don't wait for either.  Can also be
+        called from a server hook, e.g. gunicorn's ``post_fork``.
+        """
+        for client in (self.redis, self.read_redis):
+            if client is not None:
+                open_connections(client, connections)
+        if self.use_save_script:
+            save_session_script.load(self.redis)
+        if self.cache is not None:
+            self.cache.start_listener()
+        self.counters.incr('warm_ups')
+
+    def _pipeline(self):
+        return self.redis.pipeline(transaction=not self.is_cluster)
+
+    def _incr(self, name):
+        if self.metrics is not None:
+            self.metrics.incr(name)
+
+    def _observe(self, name, value):
+        if self.metrics is not None:
+            self.metrics.observe(name, value)
 
     def open_session(self, app, request):
+        if self.metrics is None:
+            return self._open_session(app, request)
+        started = default_timer()
+        try:
+            return self._open_session(app, request)
+        finally:
+            self.metrics.timing('open_session', default_timer() - started)
+
+    def _open_session(self, app, request):
+        self._check_fork()
+        if self.use_signer and not app.secret_key:
+            return None
+        sid, signature = self._unsign_cookie(app, request)
+        if sid is None:
+            return self._new_session()
+        use_primary = self._get_sticky_cookie_name(app) in request.cookies
+        refresh_ttl = self._get_refresh_ttl(app, sid)
+        if self.lazy:
+            if refresh_ttl is not None:
+                self._refresh_ttls(sid, refresh_ttl)
+            return self.lazy_session_class(sid, lambda sid: self._make_session(
+                sid, signature, self._load_data(sid, use_primary)))
+        return self._make_session(
+            sid, signature, self._load_data(sid, use_primary, refresh_ttl))
+
+    def _get_refresh_ttl(self, app, sid):
+        """Return the TTL to reset the session's keys to while opening it,
+        or ``None`` if this process refreshed them less than
+        `ttl_refresh_interval` seconds ago."""
+        if not self.ttl_refresh_interval:
+            return None
+        last_refresh = self._ttl_refreshed.get(sid)
+        now = time.time()
+        if last_refresh is not None and \
+                now - last_refresh < self.ttl_refresh_interval:
+            return None
+        self._ttl_refreshed.set(sid, now)
+        return total_seconds(app.permanent_session_lifetime)
+
+    def _refresh_ttls(self, sid, ttl):
+        self._incr('redis_round_trips')
+        self._incr('ttl_refreshes')
+        pipeline = self.redis.pipeline(transaction=False)
+        self._add_refresh_to_pipeline(pipeline, sid, ttl)
+        pipeline.execute()
+
+    def _add_refresh_to_pipeline(self, pipeline, sid, ttl, data=True):
+        if data:
+            pipeline.expire(self._get_redis_data_key(sid), ttl)
+        pipeline.expire(self._get_redis_signature_key(sid), ttl)
+        pipeline.expire(self._get_redis_groups_key(sid), ttl)
+        if self.auth_record:
+            pipeline.expire(self._get_redis_auth_key(sid), ttl)
+
+    def _unsign_cookie(self, app, request):
+        """Return the ``(sid, signature)`` of the request's session cookie,
+        or ``(None, None)`` if there is no validly signed cookie.
+        """
         # sid = request.cookies.get(app.session_cookie_name)
         sid = get_str_key(request.cookies, app.session_cookie_name)
         if not sid:
-            sid = self._generate_sid()
-            return self.session_class(sid=sid, permanent=self.permanent)
+            return None, None
+        signature = b''
         if self.use_signer:
-            signer = self._get_signer(app)
-            if signer is None:
-                return None
             try:
-                sid_as_bytes = signer.unsign(sid)
+                sid_as_bytes = self._get_signer(app).unsign(sid)
+                signature = want_bytes(sid).rsplit(b'.', 1)[1]
                 sid = sid_as_bytes.decode()
             except BadSignature:
-                sid = self._generate_sid()
-                return self.session_class(sid=sid, permanent=self.permanent)
+                self._incr('signature_failures')
+                return None, None
 
         if not PY2 and not isinstance(sid, text_type):
             sid = sid.decode('utf-8', 'strict')
-        value = self.redis.get(self._get_redis_data_key(sid))
+        return sid, signature
+
+    def _make_session(self, sid, signature, value):
         if value is not None:
+            self._observe('session_bytes', get_data_size(value))
             try:
-                # in py3, json module will throw if given bytes
-                data = self.serializer.loads(want_str(value))
-                return self.session_class(data, sid=sid)
+                data = self._decode_data(value)
+                if self.hot_fields:
+                    session = self.session_class(
+                        data, sid=sid, loaded_keys=self.hot_fields,
+                        loader=functools.partial(self._load_fields, sid))
+                else:
+                    session = self.session_class(data, sid=sid)
             except:
-                return self.session_class(sid=sid, permanent=self.permanent)
-        return self.session_class(sid=sid, permanent=self.permanent)
+                return self._new_session(sid)
+            session.mark_stored(signature, get_group_set(session))
+            return session
+        return self._new_session(sid)
+
+    def _load_data(self, sid, use_primary=False, refresh_ttl=None):
+        if self.writer is not None:
+            # a client's next request must see what its last one saved
+            self.writer.wait(sid)
+        if self.cache is None:
+            return self._read_data(sid, use_primary, refresh_ttl)
+        value = self.cache.get(sid)
+        if value is not None:
+            self._incr('cache_hits')
+            if refresh_ttl is not None:
+                self._refresh_ttls(sid, refresh_ttl)
+        else:
+            self._incr('cache_misses')
+            # taken before the read, so that an invalidation arriving
+            # while it is in flight keeps the (stale) value out
+            token = self.cache.fill_token()
+            value = self._read_data(sid, use_primary, refresh_ttl)
+            if value is not None:
+                self.cache.set(sid, value, token)
+        return value
+
+    def _read_data(self, sid, use_primary=False, refresh_ttl=None):
+        self._incr('redis_round_trips')
+        if refresh_ttl is not None:
+            self._incr('ttl_refreshes')
+            return self._fetch_data(self.redis, sid, refresh_ttl)
+        if self.read_redis is None or use_primary:
+            return self._fetch_data(self.redis, sid)
+        self._incr('replica_reads')
+        value = self._fetch_data(self.read_redis, sid)
+        if value is None:
+            # a session created moments ago may not have reached the
+            # replica yet; treating it as missing would replace it.
+            self._incr('replica_misses')
+            self._incr('redis_round_trips')
+            value = self._fetch_data(self.redis, sid)
+        return value
+
+    def _fetch_data(self, client, sid, refresh_ttl=None):
+        """Read a stored session value: bytes, or a dict of encoded hash
+        fields with `hash_fields`.  Returns ``None`` if there is none.
+
+        With a `refresh_ttl`, the TTLs of all of the session's keys are
+        reset in the same round trip.
+        """
+        key = self._get_redis_data_key(sid)
+        if refresh_ttl is None and not self.hot_fields:
+            if self.hash_fields:
+                return client.hgetall(key) or None
+            return client.get(key)
+        pipeline = client.pipeline(transaction=False)
+        if self.hot_fields:
+            pipeline.exists(key)
+            pipeline.hmget(key, self.hot_fields)
+        elif self.hash_fields:
+            pipeline.hgetall(key)
+        else:
+            pipeline.execute_command('GETEX', key, 'EX', refresh_ttl)
+        if refresh_ttl is not None:
+            self._add_refresh_to_pipeline(pipeline, sid, refresh_ttl,
+                                          data=self.hash_fields)
+        results = pipeline.execute()
+        if not self.hot_fields:
+            return results[0] or None
+        exists, values = results[:2]
+        if not exists:
+            return None
+        return dict((field, value) for field, value
+                    in zip(self.hot_fields, values) if value is not None)
+
+    def _load_fields(self, sid):
+        self._incr('redis_round_trips')
+        value = self.redis.hgetall(self._get_redis_data_key(sid))
+        self._observe('session_bytes', get_data_size(value))
+        return self._decode_data(value)
+
+    def _decode_data(self, value):
+        if not self.hash_fields:
+            return self.serializer.loads(value)
+        return dict((want_str(field), self.serializer.loads(encoded))
+                    for field, encoded in value.items())
+
+    def _encode(self, data):
+        value, size = self.serializer.encode(data)
+        if size != len(value):
+            self._observe('session_uncompressed_bytes', size)
+        return value
+
+    def _queue_read_data(self, pipeline, sid):
+        if self.hash_fields:
+            pipeline.hgetall(self._get_redis_data_key(sid))
+        else:
+            pipeline.get(self._get_redis_data_key(sid))
+
+    def _set_write_data(self, write, data):
+        """Make `write` store `data` as the session's complete contents."""
+        if self.hash_fields:
+            write.fields = dict((key, self._encode(value))
+                                for key, value in data.items())
+            write.replaces_fields = True
+        else:
+            write.data = self._encode(data)
+
+    def _get_sticky_cookie_name(self, app):
+        return app.session_cookie_name + '_primary'
+
+    def _new_session(self, sid=None):
+        if sid is None:
+            sid = self._generate_sid()
+        self._incr('new_sessions')
+        return self.session_class(sid=sid, permanent=self.permanent, new=True)
+
+    def _get_key_sid(self, session_id):
+        if self.key_hash_tags:
+            return str_fmt('{%s}', session_id)
+        return session_id
 
     @returns_bytes
     def _get_redis_data_key(self, session_id):
-        return str_fmt('%s:data:%s', self.key_prefix, session_id)
+        return str_fmt('%s:data:%s', self.key_prefix,
+                       self._get_key_sid(session_id))
 
     @returns_bytes
     def _get_redis_groups_key(self, session_id):
-        return str_fmt('%s:groups:%s', self.key_prefix, session_id)
+        return str_fmt('%s:groups:%s', self.key_prefix,
+                       self._get_key_sid(session_id))
 
     @returns_bytes
     def _get_redis_signature_key(self, session_id):
-        return str_fmt('%s:signature:%s', self.key_prefix, session_id)
+        return str_fmt('%s:signature:%s', self.key_prefix,
+                       self._get_key_sid(session_id))
+
+    @returns_bytes
+    def _get_redis_auth_key(self, session_id):
+        return str_fmt('%s:auth:%s', self.key_prefix,
+                       self._get_key_sid(session_id))
+
+    @returns_bytes
+    def _get_redis_data_key_prefix(self):
+        return str_fmt('%s:data:', self.key_prefix)
+
+    def _get_redis_data_key_pattern(self):
+        """A SCAN pattern for the data keys of this interface's layout only;
+        the other layout's keys share the prefix."""
+        if self.key_hash_tags:
+            return self._get_redis_data_key_prefix() + b'{*}'
+        return self._get_redis_data_key_prefix() + b'[^{]*'
+
+    def _get_sid_from_data_key(self, key):
+        sid = want_str(key[len(self._get_redis_data_key_prefix()):])
+        if self.key_hash_tags:
+            sid = sid[1:-1]
+        return sid
+
+    @returns_bytes
+    def _get_redis_group_index_key(self, group_id):
+        return str_fmt('%s:group_sessions:%s', self.key_prefix, group_id)
 
     def _get_session_keys(self, session_id):
         return [
@@ -181,39 +913,88 @@ class RedisSessionInterface(SessionInterface):
             self._get_redis_signature_key(session_id)
         ]
 
+    def _get_all_session_keys(self, session_id):
+        """Like :meth:`_get_session_keys`, plus the auth record if there is
+        one; these are the keys the save script writes."""
+        keys = self._get_session_keys(session_id)
+        if self.auth_record:
+            keys.append(self._get_redis_auth_key(session_id))
+        return keys
+
     def regenerate(self, session):
+        session.load()
         if session.sid:
-            self.redis.delete(*self._get_session_keys(session.sid))
+            self._delete_session(session.sid, session.stored_groups)
         session.sid = self._generate_sid()
-        session.modified = True
+        session.forget_stored()
 
     def destroy(self, session):
+        if self.group_index:
+            # the index entries to drop are only known once loaded
+            session.load()
         if session.sid:
-            self.redis.delete(*self._get_session_keys(session.sid))
+            self._delete_session(session.sid, session.stored_groups)
         session.sid = None
 
+    def _delete_session(self, sid, group_ids=()):
+        if self.writer is not None:
+            # a queued write landing after the delete would revive the sid
+            self.writer.wait(sid)
+        self._incr('redis_round_trips')
+        if self.cache is None and not self.group_index:
+            self.redis.delete(*self._get_all_session_keys(sid))
+            return
+        pipeline = self._pipeline()
+        self._add_delete_to_pipeline(pipeline, sid, group_ids)
+        pipeline.execute()
+
+    def _add_delete_to_pipeline(self, pipeline, sid, group_ids=()):
+        pipeline.delete(*self._get_all_session_keys(sid))
+        if self.cache is not None:
+            self.cache.invalidate(pipeline, sid)
+        if self.group_index:
+            for group_id in group_ids:
+                pipeline.zrem(self._get_redis_group_index_key(group_id), sid)
+
     def save_session(self, app, session, response):
+        if self.metrics is None:
+            return self._save_session(app, session, response)
+        started = default_timer()
+        try:
+            return self._save_session(app, session, response)
+        finally:
+            self.metrics.timing('save_session', default_timer() - started)
+
+    def _save_session(self, app, session, response):
+        write = self._prepare_save(app, session, response)
+        if write:
+            if self.writer is not None:
+                self.writer.submit(write)
+            else:
+                self._execute_write(write)
+            self._mark_saved(session, write)
+
+    def _prepare_save(self, app, session, response):
+        """Set (or delete) the session cookie on `response`, and return the
+        :class:`SessionWrite` that still has to be sent to Redis, if any.
+        """
         domain = self.get_cookie_domain(app)
         path = self.get_cookie_path(app)
         if not session.sid:
             response.delete_cookie(app.session_cookie_name,
                                    domain=domain, path=path)
-            return
+            return None
 
-        # Modification case.  There are upsides and downsides to
-        # emitting a set-cookie header each request.  The behavior
-        # is controlled by the :meth:`should_set_cookie` method
-        # which performs a quick check to figure out if the cookie
-        # should be set or not.  This is controlled by the
-        # SESSION_REFRESH_EACH_REQUEST config flag as well as
-        # the permanent flag on the session itself.
-        # if not self.should_set_cookie(app, session):
-        #    return
+        if not session.loaded:
+            # nothing used the session, so nothing can have changed.
+            self.counters.incr('lazy_saves_skipped')
+            return None
 
-        httponly = self.get_cookie_httponly(app)
-        secure = self.get_cookie_secure(app)
-        expires = self.get_expiration_time(app, session)
-        serialized_session = self.serializer.dumps(dict(session))
+        if self.skip_empty and session.new and is_empty_session(session):
+            # a fresh session nobody wrote to: storing it would only
+            # leave behind keys (and a cookie) that are never read.
+            self.counters.incr('empty_saves_skipped')
+            return None
 
         if self.use_signer:
             session_cookie_val = self._get_signer(app).sign(want_bytes(session.sid))
@@ -222,28 +1003,585 @@ class RedisSessionInterface(SessionInterface):
             session_cookie_val = session.sid
             session_signature = b''
 
-        session_data_key = self._get_redis_data_key(session.sid)
-        session_groups_key = self._get_redis_groups_key(session.sid)
-        session_sig_key = self._get_redis_signature_key(session.sid)
-        ttl = total_seconds(app.permanent_session_lifetime)
+        # Only keys that actually changed are rewritten; a request that
+        # neither modified the session nor needs a cookie refresh sends
+        # nothing to Redis at all.
+        write = self._get_session_write(app, session, session_signature)
+        if not write:
+            if not self.should_set_cookie(app, session):
+                self.counters.incr('unchanged_saves_skipped')
+                return None
+            # the cookie's expiry moves forward, so the keys' TTLs must
+            # too, or the session would end while its cookie is valid.
+            if self._refreshed_recently(write.sid):
+                self.counters.incr('ttl_refresh_saves_throttled')
+            else:
+                write.refresh = True
+                self.counters.incr('ttl_refresh_saves')
 
-        pipeline = self.redis.pipeline()
-        pipeline.setex(name=session_data_key,
-            value=serialized_session,
-            time=ttl
-        )
-        pipeline.setex(name=session_sig_key,
-            value=session_signature,
-            time=ttl
-        )
-        pipeline.delete(session_groups_key)
-        group_ids = session.get('groups', None)
-        if group_ids:
-            group_ids = list(set(group_ids))
-            pipeline.sadd(session_groups_key, *group_ids)
-            pipeline.expire(session_groups_key, time=ttl)
-        pipeline.execute()
+        httponly = self.get_cookie_httponly(app)
+        secure = self.get_cookie_secure(app)
+        expires = self.get_expiration_time(app, session)
         response.set_cookie(app.session_cookie_name, session_cookie_val,
                             expires=expires, httponly=httponly,
                             domain=domain, path=path, secure=secure)
+        if write and not write.refresh and self.read_redis is not None:
+            # reads from this client go to the primary until the replicas
+            # have (very likely) caught up with this write.
+            response.set_cookie(self._get_sticky_cookie_name(app), '1',
+                                max_age=self.read_sticky_seconds,
+                                httponly=httponly, domain=domain, path=path,
+                                secure=secure)
+        return write
+
+    def _mark_saved(self, session, write):
+        signature = write.signature
+        if signature is None:
+            signature = session.stored_signature
+        group_ids = write.groups
+        if group_ids is None:
+            group_ids = session.stored_groups
+        session.mark_stored(signature, group_ids)
+        # every save resets the TTLs of all of the session's keys
+        self._ttl_refreshed.set(write.sid, time.time())
+        self.counters.incr('saves')
+
+    def _refreshed_recently(self, sid):
+        # with ttl_refresh_interval, open_session sends the refresh when
+        # it is due, before the save could
+        interval = self.ttl_refresh_interval or self.refresh_save_interval
+        last_refresh = self._ttl_refreshed.get(sid)
+        return last_refresh is not None and \
+            time.time() - last_refresh < interval
+
+    def _get_session_write(self, app, session, signature):
+        ttl = total_seconds(app.permanent_session_lifetime)
+        write = SessionWrite(session.sid, ttl)
+        group_ids = get_group_set(session)
+        # a new sid may still have keys left over from an earlier session
+        if group_ids != session.stored_groups or session.new:
+            write.groups = group_ids
+            write.previous_groups = session.stored_groups
+        if self.hash_fields:
+            self._add_field_changes(write, session)
+        # in-place changes to the groups list don't flag the session as
+        # modified, so a groups change also forces the data rewrite.
+        elif session.new or session.modified or write.groups is not None:
+            write.data = self._encode(dict(session))
+        # the auth record is rebuilt along with the groups, signature
+        # included
+        if signature != session.stored_signature or \
+                (self.auth_record and write.groups is not None):
+            write.signature = signature
+        return write
+
+    def _add_field_changes(self, write, session):
+        if session.new or session.dirty_keys is None:
+            self._set_write_data(write, dict(session.items()))
+            return
+        keys = set(session.dirty_keys)
+        if write.groups is not None:
+            keys.add('groups')
+        fields = {}
+        deleted = []
+        for key in keys:
+            if key in session:
+                fields[key] = self._encode(session[key])
+            else:
+                deleted.append(key)
+        if fields:
+            write.fields = fields
+        write.deleted_fields = deleted
+
+    def _execute_write(self, write):
+        self._incr('redis_round_trips')
+        data_size = write.data_size
+        if data_size is not None:
+            self._observe('session_bytes', data_size)
+        if self.use_save_script:
+            keys, args = self._get_save_script_keys_and_args(write)
+            pipeline = self.redis.pipeline(transaction=False)
+            queued = self._add_write_side_effects(pipeline, write)
+            token = self._get_fill_token()
+            save_session_script(self.redis, keys, args)
+            if queued:
+                pipeline.execute()
+        else:
+            pipeline = self._pipeline()
+            self._add_write_to_pipeline(pipeline, write)
+            self._add_write_side_effects(pipeline, write)
+            token = self._get_fill_token()
+            pipeline.execute()
+        if self.cache is not None and write.data is not None:
+            self.cache.set(write.sid, write.data, token)
+
+    def _get_fill_token(self):
+        # taken once the write's own invalidation is queued (which drops
+        # the local entry), so that only later ones make the value stale
+        if self.cache is not None:
+            return self.cache.fill_token()
+
+    def _execute_writes(self, writes):
+        """Send several writes (of different requests) to Redis in a
+        single round trip.
+
+        A command that fails only fails the write it belongs to; return a
+        list with, for each write, the error it failed with or ``None``.
+        """
+        self._incr('redis_round_trips')
+        if self.use_save_script:
+            save_session_script.load(self.redis)
+        pipeline = self._pipeline()
+        ends = []
+        for write in writes:
+            data_size = write.data_size
+            if data_size is not None:
+                self._observe('session_bytes', data_size)
+            if self.use_save_script:
+                keys, args = self._get_save_script_keys_and_args(write)
+                pipeline.evalsha(save_session_script.sha, len(keys),
+                                 *(keys + args))
+            else:
+                self._add_write_to_pipeline(pipeline, write)
+            self._add_write_side_effects(pipeline, write)
+            ends.append(len(pipeline))
+        token = self._get_fill_token()
+        try:
+            results = pipeline.execute(raise_on_error=False)
+        except NoScriptError as e:
+            # the script was flushed before the transaction was queued
+            results = [e] * (ends[-1] if ends else 0)
+        errors = []
+        start = 0
+        for write, end in zip(writes, ends):
+            error = None
+            for result in results[start:end]:
+                if isinstance(result, Exception):
+                    error = result
+                    break
+            start = end
+            if isinstance(error, NoScriptError):
+                # the script was flushed; saves are safe to repeat, and
+                # _execute_write reloads it.
+                try:
+                    self._execute_write(write)
+                    error = None
+                except Exception as e:
+                    error = e
+            elif error is None and self.cache is not None and \
+                    write.data is not None:
+                self.cache.set(write.sid, write.data, token)
+            errors.append(error)
+        return errors
+
+    def _add_write_side_effects(self, pipeline, write):
+        """Queue cache invalidation and group index updates for `write`;
+        return whether anything was queued."""
+        queued = False
+        if self.cache is not None and write.data is not None:
+            self.cache.invalidate(pipeline, write.sid)
+            queued = True
+        if self.group_index and write.groups is not None:
+            # scores are the earliest time the sid may have expired; see
+            # cleanup_group_index.
+            expires_at = int(time.time()) + write.ttl
+            for group_id in write.groups - write.previous_groups:
+                pipeline.zadd(self._get_redis_group_index_key(group_id),
+                              {write.sid: expires_at})
+            for group_id in write.previous_groups - write.groups:
+                pipeline.zrem(self._get_redis_group_index_key(group_id),
+                              write.sid)
+            queued = True
+        return queued
+
+    def _add_auth_record_to_pipeline(self, pipeline, write):
+        auth_key = self._get_redis_auth_key(write.sid)
+        if write.groups is not None:
+            # rebuilt whole, like the groups key: patching it against the
+            # groups this request loaded could keep revoked groups after
+            # overlapping saves.  MULTI/EXEC keeps nginx from seeing it
+            # empty in between.
+            self._add_auth_rebuild_to_pipeline(
+                pipeline, write.sid, write.signature, write.groups,
+                write.ttl * 1000)
+            return
+        if write.signature is not None:
+            pipeline.hset(auth_key, AUTH_SIGNATURE_FIELD, write.signature)
+        pipeline.expire(auth_key, write.ttl)
+
+    def _get_save_script_keys_and_args(self, write):
+        """Return the KEYS and ARGV of :data:`~.scripts.save_session_script`
+        for `write`; the auth record, if any, is passed as a fourth key."""
+        if self.auth_record:
+            keys = self._get_all_session_keys(write.sid)
+        else:
+            keys = self._get_session_keys(write.sid)
+        return keys, get_save_session_args(write)
+
+    def _add_write_to_pipeline(self, pipeline, write):
+        session_data_key = self._get_redis_data_key(write.sid)
+        session_groups_key = self._get_redis_groups_key(write.sid)
+        session_sig_key = self._get_redis_signature_key(write.sid)
+        ttl = write.ttl
+
+        if write.replaces_fields:
+            pipeline.delete(session_data_key)
+        if write.deleted_fields:
+            pipeline.hdel(session_data_key, *write.deleted_fields)
+        if write.fields:
+            pipeline.hset(session_data_key, mapping=write.fields)
+        if write.data is not None:
+            pipeline.setex(name=session_data_key, value=write.data, time=ttl)
+        else:
+            pipeline.expire(session_data_key, ttl)
+        if write.signature is not None:
+            pipeline.setex(name=session_sig_key, value=write.signature,
+                           time=ttl)
+        else:
+            pipeline.expire(session_sig_key, ttl)
+        # SADD/SREM deltas against previous_groups could miss changes made
+        # by overlapping saves, so the set is replaced; MULTI/EXEC keeps
+        # nginx from seeing it empty in between.
+        if write.groups is not None:
+            pipeline.delete(session_groups_key)
+            if write.groups:
+                pipeline.sadd(session_groups_key, *list(write.groups))
+                pipeline.expire(session_groups_key, time=ttl)
+        else:
+            pipeline.expire(session_groups_key, ttl)
+        if self.auth_record:
+            self._add_auth_record_to_pipeline(pipeline, write)
+
+    def revoke_group(self, group_id, batch_size=500):
+        """Destroy every session that is a member of `group_id`, in pipelined
+        batches.  Requires ``group_index``; returns the number of sessions
+        destroyed.
+
+        Entries for the destroyed sessions in other groups' indexes are left
+        for :meth:`cleanup_group_index` to remove.
+        """
+        index_key = self._get_redis_group_index_key(group_id)
+        revoked = 0
+        while True:
+            sids = [want_str(sid) for sid in
+                    self.redis.zrange(index_key, 0, batch_size - 1)]
+            if not sids:
+                return revoked
+            pipeline = self._pipeline()
+            for sid in sids:
+                self._add_delete_to_pipeline(pipeline, sid)
+            pipeline.zrem(index_key, *sids)
+            pipeline.execute()
+            revoked += len(sids)
+
+    def strip_group(self, group_id, batch_size=500):
+        """Remove `group_id` from every session that is a member of it, in
+        pipelined batches.  Requires ``group_index``; returns the number of
+        sessions updated.
+
+        Session data is rewritten with its remaining TTL.  A session saved
+        concurrently with the strip may keep the group.
+        """
+        index_key = self._get_redis_group_index_key(group_id)
+        stripped = 0
+        while True:
+            sids = [want_str(sid) for sid in
+                    self.redis.zrange(index_key, 0, batch_size - 1)]
+            if not sids:
+                return stripped
+            pipeline = self.redis.pipeline(transaction=False)
+            for sid in sids:
+                self._queue_read_data(pipeline, sid)
+                pipeline.pttl(self._get_redis_data_key(sid))
+            results = pipeline.execute()
+
+            pipeline = self._pipeline()
+            for i, sid in enumerate(sids):
+                value, pttl = results[2 * i], results[2 * i + 1]
+                if not value or pttl <= 0:
+                    continue
+                try:
+                    data = self._decode_data(value)
+                except:
+                    continue
+                data['groups'] = [g for g in data.get('groups') or []
+                                  if g != group_id]
+                data_key = self._get_redis_data_key(sid)
+                if self.hash_fields:
+                    pipeline.hset(data_key, 'groups',
+                                  self.serializer.dumps(data['groups']))
+                    pipeline.pexpire(data_key, pttl)
+                else:
+                    pipeline.set(data_key, self.serializer.dumps(data),
+                                 px=pttl, xx=True)
+                pipeline.srem(self._get_redis_groups_key(sid), group_id)
+                if self.auth_record:
+                    pipeline.hdel(self._get_redis_auth_key(sid), group_id)
+                if self.cache is not None:
+                    self.cache.invalidate(pipeline, sid)
+                stripped += 1
+            pipeline.zrem(index_key, *sids)
+            pipeline.execute()
+
+    def cleanup_group_index(self, group_id, batch_size=500):
+        """Drop index entries for sessions that expired or left `group_id`.
+
+        Only entries whose score (the earliest possible expiry) has passed
+        are checked; entries for sessions still in the group get a new score
+        from the TTL of their groups key.  Returns the number removed.
+        """
+        index_key = self._get_redis_group_index_key(group_id)
+        removed = 0
+        while True:
+            now = int(time.time())
+            sids = self.redis.zrangebyscore(index_key, '-inf', now,
+                                            start=0, num=batch_size)
+            if not sids:
+                return removed
+            pipeline = self.redis.pipeline(transaction=False)
+            for sid in sids:
+                groups_key = self._get_redis_groups_key(want_str(sid))
+                pipeline.sismember(groups_key, group_id)
+                pipeline.ttl(groups_key)
+            results = pipeline.execute()
+
+            pipeline = self.redis.pipeline(transaction=False)
+            for i, sid in enumerate(sids):
+                is_member, ttl = results[2 * i], results[2 * i + 1]
+                if is_member:
+                    pipeline.zadd(index_key, {sid: now + max(ttl, 1)})
+                else:
+                    pipeline.zrem(index_key, sid)
+                    removed += 1
+            pipeline.execute()
+
+    def cleanup_group_indexes(self, batch_size=500):
+        """Run :meth:`cleanup_group_index` for every indexed group, e.g. from
+        a periodic job.  Returns the number of entries removed."""
+        prefix = self._get_redis_group_index_key('')
+        removed = 0
+        for index_key in self.redis.scan_iter(match=prefix + b'*',
+                                              count=batch_size):
+            group_id = want_str(index_key[len(prefix):])
+            removed += self.cleanup_group_index(group_id, batch_size)
+        return removed
+
+    def count_sessions(self, batch_size=500):
+        """Count the stored sessions with a SCAN, without reading them."""
+        match = self._get_redis_data_key_pattern()
+        return sum(1 for _ in self.redis.scan_iter(match=match,
+                                                   count=batch_size))
+
+    def iter_sessions(self, batch_size=500, rate_limit=None):
+        """Yield ``(sid, data)`` for every stored session.
+
+        Keys are found with SCAN and read with one MGET per `batch_size`
+        keys, so memory use doesn't grow with the number of sessions.  With
+        a `rate_limit`, at most that many sessions are read per second.
+        Sessions may be missed or repeated if they are created or destroyed
+        during the walk, as with any SCAN.
+        """
+        for batch in self._iter_session_batches(batch_size, rate_limit):
+            for item in batch:
+                yield item
+
+    def destroy_sessions(self, predicate, batch_size=500, rate_limit=None):
+        """Destroy every stored session for which ``predicate(sid, data)`` is
+        true, one pipeline per batch; e.g. to log a user out everywhere::
+
+            interface.destroy_sessions(
+                lambda sid, data: data.get('username') == email)
+
+        Returns the number of sessions destroyed.
+        """
+        destroyed = 0
+        for batch in self._iter_session_batches(batch_size, rate_limit):
+            doomed = [(sid, data) for sid, data in batch
+                      if predicate(sid, data)]
+            if not doomed:
+                continue
+            pipeline = self.redis.pipeline(transaction=False)
+            for sid, data in doomed:
+                self._add_delete_to_pipeline(pipeline, sid,
+                                             get_group_set(data))
+            pipeline.execute()
+            destroyed += len(doomed)
+        return destroyed
+
+    def update_sessions(self, update, batch_size=500, rate_limit=None):
+        """Rewrite stored sessions, one pipeline per batch.
+
+        ``update(sid, data)`` returns the new data for a session, or ``None``
+        to leave it alone.  Rewritten sessions keep their remaining TTL and
+        are stored in this interface's serializer format, so an identity
+        `update` migrates every session to it.  A session saved concurrently
+        by a request may overwrite the update.  Returns the number of
+        sessions rewritten.
+        """
+        updated = 0
+        for batch in self._iter_session_batches(batch_size, rate_limit):
+            changes = []
+            for sid, data in batch:
+                old_groups = get_group_set(data)
+                new_data = update(sid, data)
+                if new_data is not None:
+                    changes.append((sid, old_groups, new_data))
+            if not changes:
+                continue
+
+            pipeline = self.redis.pipeline(transaction=False)
+            for sid, _, _ in changes:
+                pipeline.pttl(self._get_redis_data_key(sid))
+                # a groups change rebuilds the auth record
+                pipeline.get(self._get_redis_signature_key(sid))
+            results = pipeline.execute()
+
+            pipeline = self._pipeline()
+            for i, (sid, old_groups, new_data) in enumerate(changes):
+                pttl, signature = results[2 * i:2 * i + 2]
+                if pttl <= 0 or signature is None:
+                    continue
+                write = SessionWrite(sid, max(1, pttl // 1000))
+                self._set_write_data(write, new_data)
+                new_groups = get_group_set(new_data)
+                if new_groups != old_groups:
+                    write.groups = new_groups
+                    write.previous_groups = old_groups
+                    if self.auth_record:
+                        write.signature = signature
+                self._add_write_to_pipeline(pipeline, write)
+                self._add_write_side_effects(pipeline, write)
+                updated += 1
+            pipeline.execute()
+        return updated
+
+    def _iter_session_batches(self, batch_size, rate_limit):
+        for keys in self._iter_data_key_batches(batch_size, rate_limit):
+            yield self._load_session_batch(keys)
+
+    def _iter_data_key_batches(self, batch_size, rate_limit):
+        match = self._get_redis_data_key_pattern()
+        started = time.time()
+        seen = 0
+        keys = []
+        for key in self.redis.scan_iter(match=match, count=batch_size):
+            keys.append(key)
+            if len(keys) < batch_size:
+                continue
+            yield keys
+            seen += len(keys)
+            keys = []
+            if rate_limit:
+                delay = float(seen) / rate_limit - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        if keys:
+            yield keys
+
+    def _load_session_batch(self, keys):
+        if self.hash_fields:
+            pipeline = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipeline.hgetall(key)
+            values = pipeline.execute()
+        elif self.is_cluster:
+            values = self.redis.mget_nonatomic(keys)
+        else:
+            values = self.redis.mget(keys)
+        batch = []
+        for key, value in zip(keys, values):
+            if not value:
+                continue
+            try:
+                data = self._decode_data(value)
+            except:
+                continue
+            batch.append((self._get_sid_from_data_key(key), data))
+        return batch
+
+    def migrate_key_layout(self, batch_size=500, rate_limit=None):
+        """Copy sessions stored in the other key layout (with or without
+        hash tags) into this interface's layout, keeping their TTLs, and
+        delete the originals.  Sessions that already exist in this layout
+        are left alone.  Returns the number of sessions migrated.
+
+        Run it right after switching ``key_hash_tags``; running it again
+        picks up sessions written in the old layout in the meantime.
+        """
+        source = RedisSessionInterface(self.redis, self.key_prefix,
+                                       hash_fields=self.hash_fields,
+                                       auth_record=self.auth_record,
+                                       key_hash_tags=not self.key_hash_tags)
+        migrated = 0
+        for keys in source._iter_data_key_batches(batch_size, rate_limit):
+            sids = [source._get_sid_from_data_key(key) for key in keys]
+            pipeline = self.redis.pipeline(transaction=False)
+            for sid in sids:
+                source._queue_read_data(pipeline, sid)
+                pipeline.pttl(source._get_redis_data_key(sid))
+                pipeline.get(source._get_redis_signature_key(sid))
+                pipeline.smembers(source._get_redis_groups_key(sid))
+                pipeline.exists(self._get_redis_data_key(sid))
+            results = pipeline.execute()
+
+            pipeline = self.redis.pipeline(transaction=False)
+            for i, sid in enumerate(sids):
+                data, pttl, signature, group_ids, exists = results[5 * i:5 * i + 5]
+                if data and pttl > 0 and not exists:
+                    data_key = self._get_redis_data_key(sid)
+                    if self.hash_fields:
+                        pipeline.hset(data_key, mapping=data)
+                        pipeline.pexpire(data_key, pttl)
+                    else:
+                        pipeline.set(data_key, data, px=pttl)
+                    if signature is not None:
+                        pipeline.set(self._get_redis_signature_key(sid),
+                                     signature, px=pttl)
+                    if group_ids:
+                        groups_key = self._get_redis_groups_key(sid)
+                        pipeline.sadd(groups_key, *list(group_ids))
+                        pipeline.pexpire(groups_key, pttl)
+                    if self.auth_record and signature is not None:
+                        self._add_auth_rebuild_to_pipeline(
+                            pipeline, sid, signature, group_ids, pttl)
+                    migrated += 1
+                for key in source._get_all_session_keys(sid):
+                    pipeline.delete(key)
+            pipeline.execute()
+        return migrated
+
+    def write_auth_records(self, batch_size=500, rate_limit=None):
+        """(Re)build the auth record of every stored session from its
+        signature and groups keys, e.g. after turning on ``auth_record``;
+        sessions saved since then already have one.  Returns the number of
+        records written.
+        """
+        written = 0
+        for keys in self._iter_data_key_batches(batch_size, rate_limit):
+            sids = [self._get_sid_from_data_key(key) for key in keys]
+            pipeline = self.redis.pipeline(transaction=False)
+            for sid in sids:
+                pipeline.pttl(self._get_redis_data_key(sid))
+                pipeline.get(self._get_redis_signature_key(sid))
+                pipeline.smembers(self._get_redis_groups_key(sid))
+            results = pipeline.execute()
+
+            pipeline = self._pipeline()
+            for i, sid in enumerate(sids):
+                pttl, signature, group_ids = results[3 * i:3 * i + 3]
+                if pttl > 0 and signature is not None:
+                    self._add_auth_rebuild_to_pipeline(
+                        pipeline, sid, signature, group_ids, pttl)
+                    written += 1
+            pipeline.execute()
+        return written
 
+    def _add_auth_rebuild_to_pipeline(self, pipeline, sid, signature,
+                                      group_ids, pttl):
+        auth_key = self._get_redis_auth_key(sid)
+        fields = dict((group_id, 1) for group_id in group_ids
+                      if want_str(group_id) != AUTH_SIGNATURE_FIELD)
+        fields[AUTH_SIGNATURE_FIELD] = signature
+        pipeline.delete(auth_key)
+        pipeline.hset(auth_key, mapping=fields)
+        pipeline.pexpire(auth_key, pttl)
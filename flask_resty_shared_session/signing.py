@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+import threading
+from collections import OrderedDict
+from itsdangerous import Signer, want_bytes
+
+
+class KeyCachingSigner(Signer):
+    """A :class:`~itsdangerous.Signer` that derives its HMAC key once,
+    instead of on every sign and verify."""
+
+    def derive_key(self, *args):
+        derived_keys = self.__dict__.setdefault('_derived_keys', {})
+        cache_key = args[0] if args else None
+        key = derived_keys.get(cache_key)
+        if key is None:
+            key = derived_keys[cache_key] = Signer.derive_key(self, *args)
+        return key
+
+
+class BoundedCache(object):
+    """A small thread-safe LRU mapping."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CookieSigner(object):
+    """Signs session ids into cookie values and verifies them back.
+
+    Recently signed sids and recently verified cookies are remembered, so
+    steady-state requests for the same session skip the HMAC work.  An
+    instance is only valid for one ``(secret_key, salt)`` pair; see
+    :meth:`SessionInterface._get_signer`.
+
+    :param secret_key: The application's secret key.
+    :param salt: The session cookie salt.
+    :param max_entries: How many sids/cookies each cache holds.
+    """
+
+    def __init__(self, secret_key, salt, max_entries=1024):
+        self.signer = KeyCachingSigner(secret_key, salt=salt,
+                                       key_derivation='hmac')
+        self._signed = BoundedCache(max_entries)
+        self._verified = BoundedCache(max_entries)
+
+    def sign(self, sid):
+        sid = want_bytes(sid)
+        cookie = self._signed.get(sid)
+        if cookie is None:
+            cookie = self.signer.sign(sid)
+            self._signed.set(sid, cookie)
+        return cookie
+
+    def unsign(self, cookie):
+        """Return the sid of a cookie value, or raise
+        :class:`~itsdangerous.BadSignature`."""
+        cookie = want_bytes(cookie)
+        sid = self._verified.get(cookie)
+        if sid is None:
+            sid = self.signer.unsign(cookie)
+            self._verified.set(cookie, sid)
+        return sid
@@ -0,0 +1,88 @@
+from __future__ import print_function
+import asyncio
+import json
+import unittest
+import flask
+import fakeredis
+from flask_resty_shared_session.aio import AsyncRedisSessionInterface
+
+
+def get_response_cookie(response, name):
+    cookie_header = response.headers.get('Set-Cookie')
+    if not cookie_header or (name not in cookie_header):
+        return None
+    start = cookie_header.index(name) + len(name) + 1
+    end = cookie_header.index(';', start)
+    return cookie_header[start:end]
+
+
+class AsyncRedisSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.secret_key = 'secret key'
+        self.app.session_cookie_name = 'session_cookie'
+        self.redis = fakeredis.FakeAsyncRedis()
+        self.interface = AsyncRedisSessionInterface(self.redis, 'aio_app',
+                                                    permanent=False)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def open_session(self, cookie=None):
+        headers = {}
+        if cookie is not None:
+            headers['Cookie'] = 'session_cookie=%s' % cookie
+        with self.app.test_request_context(headers=headers):
+            return self.run_async(self.interface.open_session(self.app, flask.request))
+
+    def save_session(self, session):
+        response = self.app.response_class()
+        self.run_async(self.interface.save_session(self.app, session, response))
+        return get_response_cookie(response, 'session_cookie')
+
+    def test_key_layout_and_round_trip(self):
+        session = self.open_session()
+        session['username'] = 'joe'
+        session['groups'] = ['one', 'two']
+        cookie = self.save_session(session)
+        sid, signature = cookie.split('.')
+        self.assertEqual(session.sid, sid)
+
+        stored_sig = self.run_async(self.redis.get('aio_app:signature:' + sid))
+        self.assertEqual(signature.encode('utf8'), stored_sig)
+        stored_groups = self.run_async(self.redis.smembers('aio_app:groups:' + sid))
+        self.assertEqual(set([b'one', b'two']), stored_groups)
+        stored_data = self.run_async(self.redis.get('aio_app:data:' + sid))
+        self.assertEqual('joe', json.loads(stored_data)['username'])
+
+        session = self.open_session(cookie)
+        self.assertEqual('joe', session['username'])
+        self.assertFalse(session.new)
+        self.assertTrue(self.save_session(session) is None)
+
+    def test_regenerate_and_destroy(self):
+        session = self.open_session()
+        session['username'] = 'joe'
+        cookie = self.save_session(session)
+        old_sid = session.sid
+
+        session = self.open_session(cookie)
+        self.run_async(self.interface.regenerate(session))
+        self.assertNotEqual(old_sid, session.sid)
+        self.assertEqual(0, self.run_async(self.redis.exists('aio_app:data:' + old_sid)))
+        cookie = self.save_session(session)
+        self.assertEqual(1, self.run_async(self.redis.exists('aio_app:data:' + session.sid)))
+
+        session = self.open_session(cookie)
+        sid = session.sid
+        self.run_async(self.interface.destroy(session))
+        self.assertEqual(0, self.run_async(self.redis.exists('aio_app:data:' + sid)))
+
+    def test_bad_signature(self):
+        session = self.open_session('not-a-sid.bad-signature')
+        self.assertTrue(session.new)
@@ -4,7 +4,21 @@ import flask
 import traceback
 import sys
 import json
-from flask.ext.resty_shared_session import RestySharedSession
+import time
+import datetime
+import threading
+import os
+import gc
+import weakref
+from flask.ext.resty_shared_session import (
+    RestySharedSession, SessionCache, PrometheusTextSink, GroupResponseCache,
+    GroupVersions
+)
+from flask_resty_shared_session.serializers import SessionSerializer
+from flask_resty_shared_session.sessions import (
+    SessionWrite, RedisSessionInterface
+)
+from flask_resty_shared_session.verifier import SessionVerifier
 import redislite
 
 
@@ -125,3 +139,1167 @@ class FlaskSessionTestCase(unittest.TestCase):
 
         response = c.post('/delete-groups')
         self.assertEqual({'status': 'deleted'}, json.loads(response.data))
+
+    def test_redis_session_unmodified_not_rewritten(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_USE_SIGNER'] = True
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_3'
+
+        RestySharedSession(app)
+        @app.route('/set', methods=['POST'])
+        def set():
+            flask.session['value'] = flask.request.form['value']
+            return 'value set'
+        @app.route('/get')
+        def get():
+            return flask.session['value']
+
+        c = app.test_client()
+        response = c.post('/set', data={'value': '42'})
+        cookie = get_response_cookie(response, 'session_cookie')
+        session_id = cookie[:cookie.index('.')]
+        data_key = 'redis_app_3:data:' + session_id
+        redis_conn.expire(data_key, 1000)
+
+        # a read-only request sends no writes and no Set-Cookie
+        response = c.get('/get')
+        self.assertEqual(b'42', response.data)
+        self.assertTrue(get_response_cookie(response, 'session_cookie') is None)
+        self.assertTrue(redis_conn.ttl(data_key) <= 1000)
+
+        # a modification rewrites the data key and refreshes its ttl
+        c.post('/set', data={'value': '43'})
+        self.assertTrue(redis_conn.ttl(data_key) > 1000)
+        self.assertEqual(b'43', c.get('/get').data)
+
+    def test_redis_session_skip_empty(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_USE_SIGNER'] = True
+        app.config['SESSION_PERMANENT'] = True
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_4'
+        app.config['SESSION_SKIP_EMPTY'] = True
+
+        RestySharedSession(app)
+        @app.route('/set', methods=['POST'])
+        def set():
+            flask.session['value'] = flask.request.form['value']
+            return 'value set'
+        @app.route('/ping')
+        def ping():
+            return 'pong'
+
+        for key in redis_conn.keys('redis_app_4:*'):
+            redis_conn.delete(key)
+        c = app.test_client()
+        response = c.get('/ping')
+        self.assertTrue(get_response_cookie(response, 'session_cookie') is None)
+        self.assertEqual([], redis_conn.keys('redis_app_4:*'))
+        counters = app.session_interface.counters
+        self.assertEqual(1, counters.get('empty_saves_skipped'))
+
+        response = c.post('/set', data={'value': '42'})
+        cookie = get_response_cookie(response, 'session_cookie')
+        session_id = cookie[:cookie.index('.')]
+        self.assertTrue(redis_conn.get('redis_app_4:data:' + session_id) is not None)
+        self.assertEqual(1, counters.get('empty_saves_skipped'))
+
+    def test_redis_session_save_script(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_USE_SIGNER'] = True
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_5'
+        app.config['SESSION_SAVE_SCRIPT'] = True
+
+        RestySharedSession(app)
+        @app.route('/set-groups', methods=['POST'])
+        def set_groups():
+            flask.session['groups'] = json.loads(flask.request.data)['groups']
+            return 'groups set'
+
+        c = app.test_client()
+        response = c.post('/set-groups', data=json.dumps({'groups': ['one', 'two']}))
+        cookie = get_response_cookie(response, 'session_cookie')
+        session_id = cookie[:cookie.index('.')]
+        self.assertEqual(set([b'one', b'two']),
+                         redis_conn.smembers('redis_app_5:groups:' + session_id))
+        self.assertEqual(cookie[cookie.index('.')+1:].encode('utf8'),
+                         redis_conn.get('redis_app_5:signature:' + session_id))
+
+        # the script is gone from the server: falls back to EVAL
+        redis_conn.script_flush()
+        c.post('/set-groups', data=json.dumps({'groups': ['three']}))
+        self.assertEqual(set([b'three']),
+                         redis_conn.smembers('redis_app_5:groups:' + session_id))
+        self.assertTrue(redis_conn.ttl('redis_app_5:groups:' + session_id) > 0)
+
+    def test_redis_session_cache(self):
+        def make_app():
+            app = flask.Flask(__name__)
+            app.secret_key = 'secret key'
+            app.session_cookie_name = 'session_cookie'
+            app.config['SESSION_TYPE'] = 'redis'
+            app.config['SESSION_REDIS'] = redislite.Redis('/tmp/session_redis.db')
+            app.config['SESSION_USE_SIGNER'] = True
+            app.config['SESSION_PERMANENT'] = False
+            app.config['SESSION_KEY_PREFIX'] = 'redis_app_6'
+            app.config['SESSION_CACHE_SIZE'] = 10
+            RestySharedSession(app)
+            @app.route('/set', methods=['POST'])
+            def set():
+                flask.session['value'] = flask.request.form['value']
+                return 'value set'
+            @app.route('/get')
+            def get():
+                return flask.session.get('value', '')
+            return app
+
+        def wait_until(predicate):
+            for _ in range(200):
+                if predicate():
+                    return
+                time.sleep(0.01)
+            self.fail('timed out')
+
+        # two "workers" sharing one session cookie
+        app_1, app_2 = make_app(), make_app()
+        cache_1 = app_1.session_interface.cache
+        cache_2 = app_2.session_interface.cache
+        c = app_1.test_client()
+        for cache in (cache_1, cache_2):
+            cache.get('warm-up')
+            wait_until(cache._subscribed.is_set)
+
+        response = c.post('/set', data={'value': '42'})
+        wait_until(lambda: cache_2.stats().get('invalidations') == 1)
+        cookie = get_response_cookie(response, 'session_cookie')
+        c2 = app_2.test_client()
+        c2.set_cookie('localhost', 'session_cookie', cookie)
+        self.assertEqual(b'42', c2.get('/get').data)
+        self.assertEqual(b'42', c2.get('/get').data)
+        self.assertEqual(1, cache_2.stats()['hits'])
+
+        c.post('/set', data={'value': '43'})
+        wait_until(lambda: cache_2.stats().get('invalidations') == 2)
+        self.assertEqual(b'43', c2.get('/get').data)
+
+    def test_session_cache_bounds(self):
+        cache = SessionCache(None, 'unused', max_entries=3, max_bytes=100)
+        cache._ensure_listener = lambda: True
+        for i in range(5):
+            cache.set('sid-%i' % i, b'x' * 10)
+        stats = cache.stats()
+        self.assertEqual(3, stats['entries'])
+        self.assertEqual(2, stats['evictions'])
+        self.assertTrue(cache.get('sid-0') is None)
+        self.assertEqual(b'x' * 10, cache.get('sid-4'))
+        cache.set('big', b'x' * 95)
+        self.assertTrue(cache.stats()['bytes'] <= 100)
+
+    def test_session_cache_fill_race(self):
+        cache = SessionCache(None, 'unused', max_entries=2)
+        cache._ensure_listener = lambda: True
+        # invalidated while the miss was being read: the value is stale
+        token = cache.fill_token()
+        cache.discard('sid-0')
+        cache.set('sid-0', b'stale', token)
+        self.assertTrue(cache.get('sid-0') is None)
+        cache.set('sid-1', b'fresh', token)
+        self.assertEqual(b'fresh', cache.get('sid-1'))
+        cache.set('sid-0', b'fresh', cache.fill_token())
+        self.assertEqual(b'fresh', cache.get('sid-0'))
+
+        # once discards are forgotten (or the cache is cleared), older
+        # fills can't tell and are skipped
+        token = cache.fill_token()
+        for i in range(3):
+            cache.discard('other-%i' % i)
+        cache.set('sid-2', b'maybe stale', token)
+        self.assertTrue(cache.get('sid-2') is None)
+        token = cache.fill_token()
+        cache.clear()
+        cache.set('sid-2', b'maybe stale', token)
+        self.assertTrue(cache.get('sid-2') is None)
+        self.assertEqual(3, cache.stats()['stale_fills_skipped'])
+
+        # the same goes for values cached after a save
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        interface = RedisSessionInterface(redis_conn, 'redis_app_25',
+                                          cache=cache)
+        interface._execute_write(SessionWrite('sid-3', 60, data=b'{}'))
+        self.assertEqual(b'{}', cache.get('sid-3'))
+        real_pipeline = interface._pipeline
+        def pipeline():
+            p = real_pipeline()
+            execute = p.execute
+            def execute_then_invalidate(*args, **kwargs):
+                result = execute(*args, **kwargs)
+                # another process saved the session meanwhile
+                cache.discard('sid-3')
+                return result
+            p.execute = execute_then_invalidate
+            return p
+        interface._pipeline = pipeline
+        interface._execute_write(SessionWrite('sid-3', 60, data=b'{"n":1}'))
+        self.assertTrue(cache.get('sid-3') is None)
+        interface._execute_writes([SessionWrite('sid-3', 60, data=b'{"n":2}')])
+        self.assertTrue(cache.get('sid-3') is None)
+
+    def test_session_serializer_formats(self):
+        data = {'username': 'joe', 'groups': ['one', 'two']}
+        json_serializer = SessionSerializer('json')
+        stored = json_serializer.dumps(data)
+        self.assertEqual(data, json.loads(stored.decode('utf8')))
+        for name in ('json', 'orjson', 'msgpack'):
+            try:
+                serializer = SessionSerializer(name)
+            except ValueError:
+                continue
+            # every format can be read back by a reader writing any other
+            self.assertEqual(data, json_serializer.loads(serializer.dumps(data)))
+            self.assertEqual(data, serializer.loads(stored))
+        self.assertRaises(ValueError, json_serializer.loads, b'\x00?junk')
+        # the default reader keeps what the stdlib writer can express
+        value = json_serializer.loads(json_serializer.dumps({'n': 2 ** 70}))
+        self.assertEqual(2 ** 70, value['n'])
+        value = json_serializer.loads(json_serializer.dumps({'x': float('nan')}))
+        self.assertTrue(value['x'] != value['x'])
+        try:
+            orjson_serializer = SessionSerializer('orjson')
+        except ValueError:
+            pass
+        else:
+            value = orjson_serializer.loads(
+                json_serializer.dumps({'x': float('nan')}))
+            self.assertTrue(value['x'] != value['x'])
+        self.assertRaises(ValueError, SessionSerializer, 'no-such-format')
+
+    def test_session_serializer_compression(self):
+        small = {'username': 'joe'}
+        large = {'cart': ['item-%06i' % i for i in range(500)]}
+        plain = SessionSerializer('json')
+        for compression in ('zlib', 'lz4', 'zstd'):
+            for name in ('json', 'msgpack'):
+                try:
+                    serializer = SessionSerializer(name, compression, 256)
+                except ValueError:
+                    continue
+                stored = serializer.dumps(large)
+                self.assertEqual(b'\x00', stored[:1])
+                self.assertTrue(len(stored) < len(plain.dumps(large)) / 2)
+                self.assertEqual(large, plain.loads(stored))
+                self.assertEqual(small, plain.loads(serializer.dumps(small)))
+                self.assertEqual(serializer.dumps(small),
+                                 SessionSerializer(name).dumps(small))
+                self.assertEqual(large, serializer.loads(plain.dumps(large)))
+        self.assertRaises(ValueError, SessionSerializer, 'json', 'no-such-codec')
+
+    def test_redis_session_secret_rotation(self):
+        app = flask.Flask(__name__)
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redislite.Redis('/tmp/session_redis.db')
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_7'
+
+        RestySharedSession(app)
+        @app.route('/set', methods=['POST'])
+        def set():
+            flask.session['value'] = flask.request.form['value']
+            return 'value set'
+        @app.route('/get')
+        def get():
+            return flask.session.get('value', 'missing')
+
+        c = app.test_client()
+        c.post('/set', data={'value': '42'})
+        self.assertEqual(b'42', c.get('/get').data)
+        signer = app.session_interface._get_signer(app)
+        self.assertTrue(signer is app.session_interface._get_signer(app))
+
+        # verified cookies are cached per secret: rotating it rejects them
+        app.secret_key = 'another secret key'
+        self.assertEqual(b'missing', c.get('/get').data)
+        self.assertFalse(signer is app.session_interface._get_signer(app))
+
+    def test_redis_session_metrics(self):
+        sink = PrometheusTextSink()
+        app = flask.Flask(__name__)
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redislite.Redis('/tmp/session_redis.db')
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_8'
+        app.config['SESSION_METRICS'] = sink
+
+        RestySharedSession(app)
+        @app.route('/set', methods=['POST'])
+        def set():
+            flask.session['value'] = flask.request.form['value']
+            return 'value set'
+        @app.route('/get')
+        def get():
+            return flask.session.get('value', 'missing')
+
+        c = app.test_client()
+        c.post('/set', data={'value': '42'})
+        c.get('/get')
+        c.set_cookie('localhost', 'session_cookie', 'bad.cookie')
+        c.get('/get')
+
+        # the bad cookie gets a fresh session, which is stored as well
+        text = sink.render()
+        self.assertTrue('resty_session_new_sessions_total 2\n' in text)
+        self.assertTrue('resty_session_signature_failures_total 1\n' in text)
+        self.assertTrue('resty_session_redis_round_trips_total 3\n' in text)
+        self.assertTrue('resty_session_open_session_seconds_count 3\n' in text)
+        self.assertTrue('resty_session_save_session_seconds_count 3\n' in text)
+        self.assertTrue('resty_session_session_bytes_count 3\n' in text)
+
+    def test_redis_session_group_updates(self):
+        for use_script in (False, True):
+            app = flask.Flask(__name__)
+            redis_conn = redislite.Redis('/tmp/session_redis.db')
+            app.secret_key = 'secret key'
+            app.session_cookie_name = 'session_cookie'
+            app.config['SESSION_TYPE'] = 'redis'
+            app.config['SESSION_REDIS'] = redis_conn
+            app.config['SESSION_PERMANENT'] = False
+            app.config['SESSION_KEY_PREFIX'] = 'redis_app_9'
+            app.config['SESSION_SAVE_SCRIPT'] = use_script
+
+            RestySharedSession(app)
+            @app.route('/set-groups', methods=['POST'])
+            def set_groups():
+                flask.session['groups'] = json.loads(flask.request.data)['groups']
+                return 'groups set'
+
+            c = app.test_client()
+            response = c.post('/set-groups', data=json.dumps({'groups': ['a', 'b', 'c']}))
+            cookie = get_response_cookie(response, 'session_cookie')
+            groups_key = 'redis_app_9:groups:' + cookie[:cookie.index('.')]
+            c.post('/set-groups', data=json.dumps({'groups': ['a', 'b', 'd']}))
+            self.assertEqual(set([b'a', b'b', b'd']), redis_conn.smembers(groups_key))
+            # the key converges even if it drifted from the groups the
+            # request loaded, e.g. after overlapping saves
+            redis_conn.sadd(groups_key, 'admin')
+            c.post('/set-groups', data=json.dumps({'groups': ['a', 'b']}))
+            self.assertEqual(set([b'a', b'b']), redis_conn.smembers(groups_key))
+            c.post('/set-groups', data=json.dumps({'groups': ['x']}))
+            self.assertEqual(set([b'x']), redis_conn.smembers(groups_key))
+            c.post('/set-groups', data=json.dumps({'groups': []}))
+            self.assertEqual(0, redis_conn.exists(groups_key))
+
+    def test_redis_session_group_index(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_10'
+        app.config['SESSION_GROUP_INDEX'] = True
+        for key in redis_conn.keys('redis_app_10:*'):
+            redis_conn.delete(key)
+
+        RestySharedSession(app)
+        interface = app.session_interface
+        @app.route('/login', methods=['POST'])
+        def login():
+            interface.regenerate(flask.session)
+            flask.session['groups'] = json.loads(flask.request.data)['groups']
+            return 'logged in'
+        @app.route('/groups')
+        def groups():
+            return ','.join(sorted(flask.session.get('groups', [])))
+
+        clients = [app.test_client() for _ in range(3)]
+        for client, groups in zip(clients, (['a', 'b'], ['a'], ['b', 'c'])):
+            client.post('/login', data=json.dumps({'groups': groups}))
+
+        # logging in again moves the sid out of the index
+        clients[2].post('/login', data=json.dumps({'groups': ['b', 'c']}))
+        self.assertEqual(2, redis_conn.zcard('redis_app_10:group_sessions:b'))
+
+        self.assertEqual(2, interface.strip_group('b'))
+        self.assertEqual(b'a', clients[0].get('/groups').data)
+        self.assertEqual(b'c', clients[2].get('/groups').data)
+        self.assertEqual(0, redis_conn.exists('redis_app_10:group_sessions:b'))
+
+        self.assertEqual(2, interface.revoke_group('a'))
+        self.assertEqual(b'', clients[0].get('/groups').data)
+        self.assertEqual(b'', clients[1].get('/groups').data)
+        self.assertEqual(b'c', clients[2].get('/groups').data)
+
+        # cleanup drops the stale entry and keeps the live one
+        redis_conn.zadd('redis_app_10:group_sessions:c', {'gone-sid': 0})
+        self.assertEqual(1, interface.cleanup_group_indexes())
+        self.assertEqual(1, redis_conn.zcard('redis_app_10:group_sessions:c'))
+
+    def test_redis_session_bulk_admin(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_11'
+        for key in redis_conn.keys('redis_app_11:*'):
+            redis_conn.delete(key)
+
+        RestySharedSession(app)
+        interface = app.session_interface
+        @app.route('/login', methods=['POST'])
+        def login():
+            flask.session['username'] = flask.request.form['username']
+            flask.session['groups'] = ['staff']
+            return 'logged in'
+        @app.route('/whoami')
+        def whoami():
+            return flask.session.get('username', '')
+
+        clients = {}
+        for i in range(7):
+            username = 'joe' if i % 3 == 0 else 'user-%i' % i
+            client = app.test_client()
+            client.post('/login', data={'username': username})
+            clients.setdefault(username, []).append(client)
+
+        self.assertEqual(7, interface.count_sessions(batch_size=2))
+        sessions = list(interface.iter_sessions(batch_size=2))
+        self.assertEqual(7, len(sessions))
+
+        self.assertEqual(3, interface.destroy_sessions(
+            lambda sid, data: data.get('username') == 'joe', batch_size=2))
+        self.assertEqual(4, interface.count_sessions())
+        for client in clients['joe']:
+            self.assertEqual(b'', client.get('/whoami').data)
+
+        def drop_groups(sid, data):
+            data['groups'] = []
+            return data
+        # joe's clients came back with fresh, empty sessions
+        self.assertEqual(7, interface.update_sessions(drop_groups, batch_size=3))
+        client = clients['user-1'][0]
+        self.assertEqual(b'user-1', client.get('/whoami').data)
+        self.assertEqual([], redis_conn.keys('redis_app_11:groups:*'))
+        self.assertTrue(redis_conn.ttl(redis_conn.keys('redis_app_11:data:*')[0]) > 0)
+
+    def test_redis_session_key_hash_tags(self):
+        def make_app(hash_tags):
+            app = flask.Flask(__name__)
+            app.secret_key = 'secret key'
+            app.session_cookie_name = 'session_cookie'
+            app.config['SESSION_TYPE'] = 'redis'
+            app.config['SESSION_REDIS'] = redislite.Redis('/tmp/session_redis.db')
+            app.config['SESSION_PERMANENT'] = False
+            app.config['SESSION_KEY_PREFIX'] = 'redis_app_12'
+            app.config['SESSION_KEY_HASH_TAGS'] = hash_tags
+            RestySharedSession(app)
+            @app.route('/login', methods=['POST'])
+            def login():
+                flask.session['username'] = 'joe'
+                flask.session['groups'] = ['one']
+                return 'logged in'
+            @app.route('/whoami')
+            def whoami():
+                return flask.session.get('username', '')
+            return app
+
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        for key in redis_conn.keys('redis_app_12:*'):
+            redis_conn.delete(key)
+        plain_app = make_app(False)
+        response = plain_app.test_client().post('/login')
+        cookie = get_response_cookie(response, 'session_cookie')
+        session_id = cookie[:cookie.index('.')]
+
+        tagged_app = make_app(True)
+        c = tagged_app.test_client()
+        c.set_cookie('localhost', 'session_cookie', cookie)
+        self.assertEqual(1, tagged_app.session_interface.migrate_key_layout())
+        self.assertEqual(b'joe', c.get('/whoami').data)
+        self.assertEqual(set([b'one']), redis_conn.smembers(
+            'redis_app_12:groups:{%s}' % session_id))
+        self.assertEqual(cookie[cookie.index('.')+1:].encode('utf8'),
+                         redis_conn.get('redis_app_12:signature:{%s}' % session_id))
+        self.assertEqual(0, redis_conn.exists('redis_app_12:data:' + session_id))
+        self.assertEqual([(session_id, {'username': 'joe', 'groups': ['one']})],
+                         list(tagged_app.session_interface.iter_sessions()))
+
+        # a second run leaves sessions already in the new layout alone
+        new_cookie = get_response_cookie(
+            tagged_app.test_client().post('/login'), 'session_cookie')
+        self.assertEqual(0, tagged_app.session_interface.migrate_key_layout())
+        self.assertEqual(2, tagged_app.session_interface.count_sessions())
+        self.assertEqual(0, plain_app.session_interface.count_sessions())
+        self.assertEqual([], redis_conn.keys('redis_app_12:*{{*'))
+        for session_cookie in (cookie, new_cookie):
+            c = tagged_app.test_client()
+            c.set_cookie('localhost', 'session_cookie', session_cookie)
+            self.assertEqual(b'joe', c.get('/whoami').data)
+
+    def test_redis_session_read_replica(self):
+        app = flask.Flask(__name__)
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redislite.Redis('/tmp/session_redis.db')
+        app.config['SESSION_READ_REDIS'] = redislite.Redis('/tmp/session_replica.db')
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_13'
+        RestySharedSession(app)
+        @app.route('/login', methods=['POST'])
+        def login():
+            flask.session['username'] = 'joe'
+            return 'logged in'
+        @app.route('/whoami')
+        def whoami():
+            return flask.session.get('username', '')
+
+        c = app.test_client()
+        response = c.post('/login')
+        self.assertTrue(any(h.startswith('session_cookie_primary=1;')
+                            for h in response.headers.getlist('Set-Cookie')))
+        cookie = get_response_cookie(response, 'session_cookie')
+        data_key = 'redis_app_13:data:' + cookie[:cookie.index('.')]
+        replica = app.config['SESSION_READ_REDIS']
+        replica.set(data_key, json.dumps({'username': 'stale'}))
+
+        # right after the write, reads stick to the primary
+        self.assertEqual(b'joe', c.get('/whoami').data)
+        c.delete_cookie('localhost', 'session_cookie_primary')
+        self.assertEqual(b'stale', c.get('/whoami').data)
+        # sessions the replica hasn't seen yet are read from the primary
+        replica.delete(data_key)
+        self.assertEqual(b'joe', c.get('/whoami').data)
+        self.assertEqual(0, replica.exists(data_key))
+
+    def test_redis_session_lazy(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_14'
+        app.config['SESSION_LAZY'] = True
+        app.config['SESSION_METRICS'] = sink = PrometheusTextSink()
+        RestySharedSession(app)
+        @app.route('/login', methods=['POST'])
+        def login():
+            flask.current_app.session_interface.regenerate(flask.session)
+            flask.session['username'] = 'joe'
+            return 'logged in'
+        @app.route('/whoami')
+        def whoami():
+            return flask.session.get('username', '')
+        @app.route('/ping')
+        def ping():
+            return 'pong'
+        @app.route('/logout', methods=['POST'])
+        def logout():
+            flask.current_app.session_interface.destroy(flask.session)
+            return 'logged out'
+
+        c = app.test_client()
+        c.post('/login')
+        c.post('/login')
+        self.assertEqual(b'joe', c.get('/whoami').data)
+        round_trips = sink._counters['redis_round_trips']
+        response = c.get('/ping')
+        self.assertTrue(get_response_cookie(response, 'session_cookie') is None)
+        self.assertEqual(round_trips, sink._counters['redis_round_trips'])
+        self.assertEqual(1, app.session_interface.counters.get('lazy_saves_skipped'))
+
+        response = c.post('/logout')
+        self.assertEqual('', get_response_cookie(response, 'session_cookie'))
+        self.assertEqual([], redis_conn.keys('redis_app_14:*'))
+
+    def test_redis_session_hash_fields(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_15'
+        app.config['SESSION_HASH_FIELDS'] = True
+        app.config['SESSION_HOT_FIELDS'] = ['username']
+        app.config['SESSION_METRICS'] = sink = PrometheusTextSink()
+        RestySharedSession(app)
+        @app.route('/login', methods=['POST'])
+        def login():
+            flask.session['username'] = 'joe'
+            flask.session['cart'] = ['apple', 'pear']
+            flask.session['groups'] = ['one']
+            return 'logged in'
+        @app.route('/rename', methods=['POST'])
+        def rename():
+            flask.session['username'] = 'bob'
+            flask.session['groups'].append('two')
+            return 'renamed'
+        @app.route('/whoami')
+        def whoami():
+            return flask.session.get('username', '')
+        @app.route('/cart', methods=['GET', 'DELETE'])
+        def cart():
+            if flask.request.method == 'DELETE':
+                flask.session.pop('cart')
+            return ','.join(flask.session.get('cart', []))
+        @app.route('/regenerate', methods=['POST'])
+        def regenerate():
+            flask.current_app.session_interface.regenerate(flask.session)
+            return 'regenerated'
+
+        for key in redis_conn.keys('redis_app_15:*'):
+            redis_conn.delete(key)
+        c = app.test_client()
+        response = c.post('/login')
+        cookie = get_response_cookie(response, 'session_cookie')
+        session_id = cookie[:cookie.index('.')]
+        data_key = 'redis_app_15:data:' + session_id
+        self.assertEqual(b'hash', redis_conn.type(data_key))
+        self.assertEqual(b'"joe"', redis_conn.hget(data_key, 'username'))
+
+        # only the changed fields are written back
+        redis_conn.hset(data_key, 'cart', json.dumps(['plum']))
+        c.post('/rename')
+        self.assertEqual(b'"bob"', redis_conn.hget(data_key, 'username'))
+        self.assertEqual(set([b'one', b'two']), redis_conn.smembers(
+            'redis_app_15:groups:' + session_id))
+        self.assertEqual(['one', 'two'],
+                         json.loads(redis_conn.hget(data_key, 'groups')))
+
+        # cold fields cost a second round trip, and only when used
+        round_trips = sink._counters['redis_round_trips']
+        self.assertEqual(b'bob', c.get('/whoami').data)
+        self.assertEqual(round_trips + 1, sink._counters['redis_round_trips'])
+        self.assertEqual(b'plum', c.get('/cart').data)
+        self.assertEqual(round_trips + 3, sink._counters['redis_round_trips'])
+
+        # a new sid keeps the fields that weren't loaded yet
+        response = c.post('/regenerate')
+        cookie = get_response_cookie(response, 'session_cookie')
+        self.assertNotEqual(session_id, cookie[:cookie.index('.')])
+        session_id = cookie[:cookie.index('.')]
+        data_key = 'redis_app_15:data:' + session_id
+        self.assertEqual(b'plum', c.get('/cart').data)
+
+        c.delete('/cart')
+        self.assertFalse(redis_conn.hexists(data_key, 'cart'))
+        self.assertEqual([(session_id, {'username': 'bob',
+                                        'groups': ['one', 'two']})],
+                         list(app.session_interface.iter_sessions()))
+        self.assertRaises(ValueError, app.session_interface.__class__,
+                          redis_conn, 'redis_app_15', hot_fields=['username'])
+
+    def test_redis_session_ttl_refresh(self):
+        for permanent in (False, True):
+            app = flask.Flask(__name__)
+            redis_conn = redislite.Redis('/tmp/session_redis.db')
+            app.secret_key = 'secret key'
+            app.session_cookie_name = 'session_cookie'
+            app.permanent_session_lifetime = datetime.timedelta(seconds=100)
+            app.config['SESSION_TYPE'] = 'redis'
+            app.config['SESSION_REDIS'] = redis_conn
+            app.config['SESSION_PERMANENT'] = permanent
+            app.config['SESSION_KEY_PREFIX'] = 'redis_app_16'
+            app.config['SESSION_TTL_REFRESH_INTERVAL'] = 600
+            RestySharedSession(app)
+            @app.route('/login', methods=['POST'])
+            def login():
+                flask.session['username'] = 'joe'
+                flask.session['groups'] = ['one']
+                return 'logged in'
+            @app.route('/whoami')
+            def whoami():
+                return flask.session.get('username', '')
+
+            c = app.test_client()
+            response = c.post('/login')
+            cookie = get_response_cookie(response, 'session_cookie')
+            session_id = cookie[:cookie.index('.')]
+            keys = [k % session_id for k in ('redis_app_16:data:%s',
+                                             'redis_app_16:groups:%s',
+                                             'redis_app_16:signature:%s')]
+            def age_keys():
+                for key in keys:
+                    redis_conn.expire(key, 10)
+            def assert_aged():
+                self.assertTrue(all(redis_conn.ttl(key) <= 10 for key in keys))
+            refreshed = app.session_interface._ttl_refreshed
+
+            # refreshed by the save just now
+            age_keys()
+            self.assertEqual(b'joe', c.get('/whoami').data)
+            assert_aged()
+            # re-sent cookies don't refresh more often than the interval
+            refreshed.set(session_id, time.time() - 120)
+            self.assertEqual(b'joe', c.get('/whoami').data)
+            assert_aged()
+
+            # once the interval has passed, a read-only request refreshes
+            # all keys
+            refreshed.set(session_id, time.time() - 601)
+            self.assertEqual(b'joe', c.get('/whoami').data)
+            self.assertTrue(all(redis_conn.ttl(key) > 90 for key in keys))
+            age_keys()
+            self.assertEqual(b'joe', c.get('/whoami').data)
+            assert_aged()
+            counters = app.session_interface.counters
+            self.assertEqual(0, counters.get('ttl_refresh_saves'))
+
+    def test_redis_session_auth_record(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_17'
+        app.config['SESSION_AUTH_RECORD'] = True
+        RestySharedSession(app)
+        @app.route('/groups', methods=['POST'])
+        def set_groups():
+            flask.session['groups'] = flask.request.form.getlist('group')
+            return 'ok'
+        @app.route('/logout', methods=['POST'])
+        def logout():
+            flask.current_app.session_interface.destroy(flask.session)
+            return 'logged out'
+
+        for key in redis_conn.keys('redis_app_17:*'):
+            redis_conn.delete(key)
+        verifiers = [SessionVerifier(redis_conn, 'redis_app_17'),
+                     SessionVerifier(redis_conn, 'redis_app_17',
+                                     auth_record=False)]
+        c = app.test_client()
+        response = c.post('/groups', data={'group': ['one', 'two']})
+        cookie = get_response_cookie(response, 'session_cookie')
+        session_id = cookie[:cookie.index('.')]
+        forged = cookie[:-1] + ('A' if cookie[-1] != 'A' else 'B')
+        for verifier in verifiers:
+            self.assertTrue(verifier.verify_signature(cookie))
+            self.assertTrue(verifier.authorize(cookie, 'one'))
+            self.assertFalse(verifier.authorize(cookie, 'three'))
+            self.assertFalse(verifier.authorize(forged, 'one'))
+            self.assertFalse(verifier.authorize(cookie, ''))
+
+        c.post('/groups', data={'group': ['one', 'three']})
+        for verifier in verifiers:
+            self.assertFalse(verifier.authorize(cookie, 'two'))
+            self.assertTrue(verifier.authorize(cookie, 'three'))
+
+        # the record converges even if it drifted from the groups the
+        # request loaded, e.g. after overlapping saves
+        auth_key = 'redis_app_17:auth:' + session_id
+        redis_conn.hset(auth_key, 'admin', 1)
+        c.post('/groups', data={'group': ['one']})
+        self.assertFalse(verifiers[0].authorize(cookie, 'admin'))
+        self.assertTrue(verifiers[0].authorize(cookie, 'one'))
+
+        redis_conn.delete(auth_key)
+        self.assertFalse(verifiers[0].authorize(cookie, 'one'))
+        self.assertEqual(1, app.session_interface.write_auth_records())
+        self.assertTrue(verifiers[0].authorize(cookie, 'one'))
+        self.assertTrue(redis_conn.ttl(auth_key) > 0)
+
+        c.post('/logout')
+        self.assertEqual(0, redis_conn.exists(auth_key))
+        self.assertFalse(verifiers[0].verify_signature(cookie))
+
+    def test_redis_session_auth_record_save_script(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_24'
+        app.config['SESSION_AUTH_RECORD'] = True
+        app.config['SESSION_SAVE_SCRIPT'] = True
+        RestySharedSession(app)
+        @app.route('/groups', methods=['POST'])
+        def set_groups():
+            flask.session['groups'] = flask.request.form.getlist('group')
+            return 'ok'
+
+        for key in redis_conn.keys('redis_app_24:*'):
+            redis_conn.delete(key)
+        # the script writes the auth record; saves take no other round trip
+        real_pipeline = redis_conn.pipeline
+        def pipeline(*args, **kwargs):
+            p = real_pipeline(*args, **kwargs)
+            def execute(*args, **kwargs):
+                raise AssertionError('unexpected round trip')
+            p.execute = execute
+            return p
+        redis_conn.pipeline = pipeline
+        c = app.test_client()
+        response = c.post('/groups', data={'group': ['one', 'two']})
+        self.assertEqual(200, response.status_code)
+        c.post('/groups', data={'group': ['one', 'three']})
+        cookie = get_response_cookie(response, 'session_cookie')
+        auth_key = 'redis_app_24:auth:' + cookie[:cookie.index('.')]
+        record = redis_conn.hgetall(auth_key)
+        self.assertEqual({b'', b'one', b'three'}, set(record))
+        self.assertTrue(redis_conn.ttl(auth_key) > 0)
+        verifier = SessionVerifier(redis_conn, 'redis_app_24')
+        self.assertTrue(verifier.authorize(cookie, 'three'))
+        self.assertFalse(verifier.authorize(cookie, 'two'))
+
+        redis_conn.hset(auth_key, 'admin', 1)
+        c.post('/groups')
+        self.assertEqual({b''}, set(redis_conn.hgetall(auth_key)))
+        self.assertTrue(verifier.verify_signature(cookie))
+        self.assertFalse(verifier.authorize(cookie, 'admin'))
+
+    def test_group_response_cache(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_18'
+        RestySharedSession(app)
+        response_cache = GroupResponseCache(timeout=60, poll_interval=0.01)
+        calls = []
+        @app.route('/login', methods=['POST'])
+        def login():
+            flask.session['groups'] = ['one', 'two', 7]
+            return 'logged in'
+        @app.route('/group/<group_id>/report')
+        @response_cache.cached()
+        def report(group_id):
+            calls.append(group_id)
+            time.sleep(0.2)
+            return flask.jsonify(group=group_id, call=len(calls))
+
+        for key in redis_conn.keys('redis_app_18:*'):
+            redis_conn.delete(key)
+        clients = [app.test_client() for _ in range(3)]
+        for c in clients:
+            c.post('/login')
+        bodies = []
+        def fetch(c):
+            bodies.append(c.get('/group/one/report').data)
+        threads = [threading.Thread(target=fetch, args=(c,)) for c in clients]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # concurrent misses were coalesced into one call
+        self.assertEqual(['one'], calls)
+        self.assertEqual(1, len(set(bodies)))
+        self.assertEqual({'group': 'one', 'call': 1}, json.loads(bodies[0].decode('utf8')))
+        self.assertEqual(bodies[0], clients[0].get('/group/one/report').data)
+        self.assertEqual(['one'], calls)
+
+        clients[0].get('/group/two/report')
+        self.assertEqual(['one', 'two'], calls)
+        self.assertEqual(403, clients[0].get('/group/three/report').status_code)
+        self.assertEqual(403, app.test_client().get('/group/one/report').status_code)
+        self.assertEqual(['one', 'two'], calls)
+        # numeric group ids match the URL's text, as they do for nginx
+        self.assertEqual(200, clients[0].get('/group/7/report').status_code)
+
+    def test_group_versions(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_19'
+        RestySharedSession(app)
+        versions = GroupVersions()
+        response_cache = GroupResponseCache(versioned=True)
+        calls = []
+        @app.route('/login', methods=['POST'])
+        def login():
+            flask.session['groups'] = ['one']
+            return 'logged in'
+        @app.route('/group/<group_id>/report')
+        @response_cache.cached()
+        def report(group_id):
+            calls.append(group_id)
+            return 'report %i' % len(calls)
+        @app.route('/group/<group_id>/report', methods=['POST'])
+        @versions.bumps()
+        def update_report(group_id):
+            return 'updated'
+        @app.route('/group/<group_id>/page')
+        def page(group_id):
+            return versions.stamp(flask.make_response('page'), group_id)
+
+        for key in redis_conn.keys('redis_app_19:*'):
+            redis_conn.delete(key)
+        c = app.test_client()
+        c.post('/login')
+        with app.app_context():
+            self.assertEqual(0, versions.get('one'))
+            self.assertEqual('base:v0', versions.cache_key('one', 'base'))
+
+        self.assertEqual(b'report 1', c.get('/group/one/report').data)
+        self.assertEqual(b'report 1', c.get('/group/one/report').data)
+        response = c.get('/group/one/page')
+        etag = response.headers['ETag']
+        self.assertEqual(304, c.get('/group/one/page',
+                                    headers={'If-None-Match': etag}).status_code)
+
+        # a write bumps the version, which invalidates both
+        c.post('/group/one/report')
+        self.assertEqual(b'report 2', c.get('/group/one/report').data)
+        self.assertEqual(200, c.get('/group/one/page',
+                                    headers={'If-None-Match': etag}).status_code)
+        with app.app_context():
+            self.assertEqual({'one': 1, 'two': 0}, versions.get_many(['one', 'two']))
+
+    def test_deferred_writes(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_20'
+        app.config['SESSION_DEFERRED_WRITES'] = True
+        app.config['SESSION_DEFERRED_WORKERS'] = 2
+        RestySharedSession(app)
+        @app.route('/set/<value>', methods=['POST'])
+        def set_value(value):
+            flask.session['value'] = value
+            return 'value set'
+        @app.route('/get')
+        def get_value():
+            return flask.session.get('value', 'none')
+
+        for key in redis_conn.keys('redis_app_20:*'):
+            redis_conn.delete(key)
+        writer = app.session_interface.writer
+        execute = writer.execute
+        released = threading.Event()
+        def held_execute(write):
+            released.wait()
+            execute(write)
+        writer.execute = held_execute
+
+        # the cookie is set before anything reaches Redis
+        c = app.test_client()
+        response = c.post('/set/1')
+        self.assertTrue(get_response_cookie(response, 'session_cookie'))
+        self.assertEqual([], redis_conn.keys('redis_app_20:*'))
+        self.assertFalse(writer.flush(0.01))
+        released.set()
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(b'1', c.get('/get').data)
+
+        # reads in this process wait for the session's queued writes
+        released.clear()
+        c.post('/set/2')
+        threading.Timer(0.05, released.set).start()
+        self.assertEqual(b'2', c.get('/get').data)
+        self.assertEqual(1, writer.counters.get('read_waits'))
+
+        # writes of one sid are applied in the order they were queued
+        writer.execute = lambda write: executed.append(write)
+        executed = []
+        writes = [SessionWrite(sid, 60) for sid in ['a', 'b'] * 50]
+        for write in writes:
+            writer.submit(write)
+        writer.close()
+        self.assertEqual([w for w in writes if w.sid == 'a'],
+                         [w for w in executed if w.sid == 'a'])
+        self.assertEqual(100, len(executed))
+        self.assertEqual(102, writer.counters.get('writes'))
+
+    def test_group_commit(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_PERMANENT'] = False
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_21'
+        app.config['SESSION_GROUP_COMMIT'] = True
+        app.config['SESSION_GROUP_COMMIT_WINDOW'] = 0.05
+        RestySharedSession(app)
+        @app.route('/set/<value>', methods=['POST'])
+        def set_value(value):
+            flask.session['value'] = value
+            return 'value set'
+        @app.route('/get')
+        def get_value():
+            return flask.session.get('value', 'none')
+
+        for key in redis_conn.keys('redis_app_21:*'):
+            redis_conn.delete(key)
+        clients = [app.test_client() for _ in range(8)]
+        threads = [threading.Thread(target=c.post, args=('/set/%i' % i,))
+                   for i, c in enumerate(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # every save returned only once its write was stored
+        for i, c in enumerate(clients):
+            self.assertEqual(str(i).encode(), c.get('/get').data)
+        writer = app.session_interface.writer
+        self.assertEqual(8, writer.counters.get('writes'))
+        self.assertTrue(writer.counters.get('batches') < 8)
+
+        # a failed batch fails its saves
+        def failing_batch(writes):
+            raise ValueError('redis is down')
+        writer.execute_batch = failing_batch
+        self.assertEqual(500, clients[0].post('/set/9').status_code)
+        self.assertEqual(1, writer.counters.get('write_errors'))
+        writer.close()
+
+        interface = app.session_interface.__class__(
+            redis_conn, 'redis_app_21', use_save_script=True)
+        writes = [SessionWrite('sid-%i' % i, 60, data=b'{"n": 1}',
+                               signature=b'sig', groups=frozenset(['one']))
+                  for i in range(3)]
+        self.assertEqual([None] * 3, interface._execute_writes(writes))
+        self.assertEqual(b'{"n": 1}', redis_conn.get('redis_app_21:data:sid-2'))
+        self.assertEqual({b'one'},
+                         redis_conn.smembers('redis_app_21:groups:sid-0'))
+
+        # a failed command only fails the write it belongs to
+        redis_conn.set('redis_app_21:groups:sid-1', b'not a set')
+        writes = [SessionWrite('sid-%i' % i, 60, data=b'{"n": 2}',
+                               groups=frozenset(['one', 'two']),
+                               previous_groups=frozenset(['one']))
+                  for i in range(3)]
+        errors = interface._execute_writes(writes)
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], Exception)
+        self.assertIsNone(errors[2])
+        self.assertEqual({b'one', b'two'},
+                         redis_conn.smembers('redis_app_21:groups:sid-2'))
+        self.assertEqual(b'{"n": 2}', redis_conn.get('redis_app_21:data:sid-0'))
+
+    def test_pool_config_and_warm_up(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS_URL'] = 'unix://' + redis_conn.socket_file
+        app.config['SESSION_REDIS_MAX_CONNECTIONS'] = 5
+        app.config['SESSION_REDIS_SOCKET_TIMEOUT'] = 2
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_22'
+        app.config['SESSION_SAVE_SCRIPT'] = True
+        app.config['SESSION_WARM_UP_CONNECTIONS'] = 3
+        RestySharedSession(app)
+        interface = app.session_interface
+        pool = interface.redis.connection_pool
+        self.assertEqual(5, pool.max_connections)
+        self.assertEqual(2, pool.connection_kwargs['socket_timeout'])
+        self.assertEqual(3, len(pool._available_connections))
+        self.assertEqual(1, interface.counters.get('warm_ups'))
+        from flask_resty_shared_session.scripts import save_session_script
+        self.assertEqual([True], redis_conn.script_exists(save_session_script.sha))
+
+        # a forked worker drops the inherited connections and warms up again
+        pid = os.fork()
+        if pid == 0:
+            ok = interface.counters.get('fork_resets') == 1 and \
+                interface.counters.get('warm_ups') == 2 and \
+                len(pool._available_connections) == 3 and \
+                all(c._sock is None or c.pid == os.getpid()
+                    for c in pool._available_connections)
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertEqual(0, interface.counters.get('fork_resets'))
+
+        # the fork and exit hooks don't keep discarded interfaces alive
+        interface = RedisSessionInterface(redis_conn, 'redis_app_22',
+                                          deferred_writes=True)
+        ref = weakref.ref(interface)
+        writer_ref = weakref.ref(interface.writer)
+        del interface
+        gc.collect()
+        self.assertIsNone(ref())
+        self.assertIsNone(writer_ref())
+
+    def test_redis_session_cookie_refresh_extends_ttl(self):
+        app = flask.Flask(__name__)
+        redis_conn = redislite.Redis('/tmp/session_redis.db')
+        app.secret_key = 'secret key'
+        app.session_cookie_name = 'session_cookie'
+        app.permanent_session_lifetime = datetime.timedelta(seconds=100)
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_conn
+        app.config['SESSION_KEY_PREFIX'] = 'redis_app_23'
+        RestySharedSession(app)
+        @app.route('/login', methods=['POST'])
+        def login():
+            flask.session['username'] = 'joe'
+            flask.session['groups'] = ['one']
+            return 'logged in'
+        @app.route('/whoami')
+        def whoami():
+            return flask.session.get('username', '')
+
+        for key in redis_conn.keys('redis_app_23:*'):
+            redis_conn.delete(key)
+        c = app.test_client()
+        c.post('/login')
+        keys = redis_conn.keys('redis_app_23:*')
+        self.assertEqual(3, len(keys))
+        for key in keys:
+            redis_conn.expire(key, 10)
+
+        # the keys were just saved, so re-sending the cookie sends nothing
+        response = c.get('/whoami')
+        self.assertEqual(b'joe', response.data)
+        cookie = get_response_cookie(response, 'session_cookie')
+        self.assertTrue(cookie)
+        counters = app.session_interface.counters
+        self.assertEqual(1, counters.get('ttl_refresh_saves_throttled'))
+        self.assertEqual(0, counters.get('ttl_refresh_saves'))
+
+        # later, the re-sent cookie expires later, and so do the keys
+        app.session_interface._ttl_refreshed.set(
+            cookie[:cookie.index('.')], time.time() - 120)
+        c.get('/whoami')
+        for key in keys:
+            self.assertTrue(redis_conn.ttl(key) > 90)
+        self.assertEqual(1, counters.get('ttl_refresh_saves'))
+
+        app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+        c.get('/whoami')
+        self.assertEqual(1, counters.get('ttl_refresh_saves'))
+        self.assertEqual(1, counters.get('unchanged_saves_skipped'))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""A Python reference implementation of the checks the OpenResty module
+(``resty/lib/resty/shared_session.lua``) makes, for tests, benchmarks and
+gatekeepers that don't run in nginx.
+"""
+
+from itsdangerous import want_bytes
+
+from .sessions import RedisSessionInterface, AUTH_SIGNATURE_FIELD, want_str
+
+SID_LENGTH = 36
+COOKIE_LENGTH = 64
+
+
+class SessionVerifier(object):
+    """Authorizes requests by their session cookie, reading Redis exactly
+    as the Lua module does.
+
+    :param redis: A ``redis.Redis`` instance.
+    :param key_prefix: The application's ``SESSION_KEY_PREFIX``.
+    :param auth_record: Whether to read the auth record (the application
+                        must use ``SESSION_AUTH_RECORD``) instead of the
+                        signature and groups keys.
+    :param key_hash_tags: Whether the application uses
+                          ``SESSION_KEY_HASH_TAGS``.
+    """
+
+    def __init__(self, redis, key_prefix, auth_record=True,
+                 key_hash_tags=False):
+        self.redis = redis
+        self.auth_record = auth_record
+        self._keys = RedisSessionInterface(redis, key_prefix,
+                                           key_hash_tags=key_hash_tags)
+
+    def parse_cookie(self, cookie):
+        """Return the ``(sid, signature)`` of a session cookie value, or
+        ``None`` if it is malformed."""
+        cookie = want_str(cookie)
+        if cookie is None or len(cookie) != COOKIE_LENGTH or \
+                cookie[SID_LENGTH] != '.':
+            return None
+        return cookie[:SID_LENGTH], cookie[SID_LENGTH + 1:]
+
+    def verify_signature(self, cookie):
+        parsed = self.parse_cookie(cookie)
+        if parsed is None:
+            return False
+        sid, signature = parsed
+        if self.auth_record:
+            stored = self.redis.hget(self._keys._get_redis_auth_key(sid),
+                                     AUTH_SIGNATURE_FIELD)
+        else:
+            stored = self.redis.get(self._keys._get_redis_signature_key(sid))
+        return stored is not None and stored == want_bytes(signature)
+
+    def is_group_member(self, cookie, group_id):
+        """Whether the cookie's session is in `group_id`; like the Lua
+        module, this doesn't check the signature."""
+        parsed = self.parse_cookie(cookie)
+        if parsed is None or group_id == AUTH_SIGNATURE_FIELD:
+            return False
+        sid = parsed[0]
+        if self.auth_record:
+            return bool(self.redis.hexists(
+                self._keys._get_redis_auth_key(sid), group_id))
+        group_id = want_bytes(group_id)
+        members = self.redis.smembers(self._keys._get_redis_groups_key(sid))
+        for member in members:
+            if member == group_id:
+                return True
+        return False
+
+    def authorize(self, cookie, group_id):
+        """Whether the cookie is validly signed and its session is in
+        `group_id`.  Takes one round trip with the auth record, and two
+        without."""
+        if not self.auth_record:
+            return self.verify_signature(cookie) and \
+                self.is_group_member(cookie, group_id)
+        parsed = self.parse_cookie(cookie)
+        if parsed is None or group_id == AUTH_SIGNATURE_FIELD:
+            return False
+        sid, signature = parsed
+        stored, member = self.redis.hmget(
+            self._keys._get_redis_auth_key(sid),
+            [AUTH_SIGNATURE_FIELD, group_id])
+        return stored is not None and stored == want_bytes(signature) and \
+            member is not None
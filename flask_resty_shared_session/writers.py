@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2017 by Scott Ivey, under BSD license.
+
+"""Alternative ways for a session interface to send its writes to Redis.
+
+By default ``save_session`` executes each :class:`~.sessions.SessionWrite`
+itself, before the response is returned.  A writer takes over that step:
+the interface calls ``writer.submit(write)`` instead, and
+``writer.wait(sid)`` before it reads a session.
+"""
+
+import atexit
+import os
+import threading
+import time
+import weakref
+
+try:
+    from queue import Queue, Full, Empty
+except ImportError:
+    from Queue import Queue, Full, Empty
+
+from .stats import Counters
+
+_STOP = object()
+
+
+def weak_method(method):
+    """Wrap the bound `method` in a callable that doesn't keep its object
+    alive, for process-wide hooks such as ``atexit`` and
+    ``os.register_at_fork``, which are never unregistered.  Once the object
+    is collected, calling it does nothing."""
+    # weakref.WeakMethod doesn't exist on Python 2
+    ref = weakref.ref(method.__self__)
+    func = method.__func__
+
+    def call(*args, **kwargs):
+        obj = ref()
+        if obj is not None:
+            return func(obj, *args, **kwargs)
+    return call
+
+
+class DeferredWriter(object):
+    """Executes writes on background threads, so that requests don't wait
+    for Redis.
+
+    Writes are spread over `workers` queues by sid, so that the writes of
+    one session are executed in order.  The queues hold at most
+    `max_queued` writes each; when one is full, submitting blocks until
+    there is room again.  Pending writes are flushed when the process
+    exits (or :meth:`close` is called).
+
+    :param execute: Called with each write, on a worker thread.
+    :param max_queued: The bound of each worker's queue.
+    :param workers: The number of worker threads.
+    """
+
+    def __init__(self, execute, max_queued=10000, workers=1):
+        self.execute = execute
+        self.max_queued = max_queued
+        self.workers = workers
+        self.counters = Counters()
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._pending = {}
+        self._queues = None
+        self._threads = []
+        self._pid = None
+        atexit.register(weak_method(self.close))
+
+    def _get_queues(self):
+        # threads don't survive a fork, so a child starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+        return self._queues
+
+    def _start(self):
+        self._pending = {}
+        self._queues = [Queue(self.max_queued) for _ in range(self.workers)]
+        self._threads = []
+        for queue in self._queues:
+            thread = threading.Thread(target=self._run, args=(queue,),
+                                      name='session-writer')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        self._pid = os.getpid()
+
+    def submit(self, write):
+        queues = self._get_queues()
+        queue = queues[hash(write.sid) % len(queues)]
+        with self._lock:
+            self._pending[write.sid] = self._pending.get(write.sid, 0) + 1
+        try:
+            queue.put_nowait(write)
+        except Full:
+            self.counters.incr('queue_full_waits')
+            queue.put(write)
+
+    def _run(self, queue):
+        while True:
+            write = queue.get()
+            if write is _STOP:
+                return
+            try:
+                self.execute(write)
+                self.counters.incr('writes')
+            except Exception:
+                self.counters.incr('write_errors')
+            finally:
+                with self._lock:
+                    remaining = self._pending.pop(write.sid) - 1
+                    if remaining:
+                        self._pending[write.sid] = remaining
+                    self._done.notify_all()
+
+    def wait(self, sid, timeout=None):
+        """Block until the pending writes of `sid`, if any, are executed;
+        return whether they were."""
+        with self._lock:
+            if sid not in self._pending:
+                return True
+            self.counters.incr('read_waits')
+            return self._wait_until(lambda: sid not in self._pending, timeout)
+
+    def flush(self, timeout=None):
+        """Block until every pending write is executed; return whether they
+        were."""
+        with self._lock:
+            return self._wait_until(lambda: not self._pending, timeout)
+
+    def _wait_until(self, predicate, timeout):
+        # Condition.wait_for doesn't exist on Python 2
+        if timeout is None:
+            while not predicate():
+                self._done.wait()
+            return True
+        deadline = time.time() + timeout
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Flush pending writes and stop the worker threads."""
+        if self._pid != os.getpid():
+            return
+        for queue in self._queues:
+            queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
+
+
+class GroupCommitWriter(object):
+    """Sends the writes of concurrent requests to Redis together.
+
+    A save blocks until its write is stored, as without a writer, but
+    rather than sending it itself it hands it to a committer thread.  That
+    thread sends every write queued while it was busy (up to `max_batch`)
+    in a single pipeline, then wakes the waiting saves.  A save whose
+    write failed raises the error; the rest of its batch is unaffected.
+
+    :param execute_batch: Called with a list of writes, on the committer
+                          thread.  Returns a list with the error each write
+                          failed with, or ``None``; if it raises, every
+                          write in the batch fails.
+    :param window: How long, in seconds, the first write of a batch waits
+                   for others to join it.  Under load the batches fill up
+                   while the previous one is sent anyway, so the default
+                   of 0 rarely makes them smaller, and doesn't slow down
+                   saves when there is little traffic.
+    :param max_batch: The most writes sent in one batch.
+    """
+
+    def __init__(self, execute_batch, window=0, max_batch=64):
+        self.execute_batch = execute_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.counters = Counters()
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        atexit.register(weak_method(self.close))
+
+    def _get_queue(self):
+        # threads don't survive a fork, so a child starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = Queue()
+                    self._thread = threading.Thread(
+                        target=self._run, args=(self._queue,),
+                        name='session-group-commit')
+                    self._thread.daemon = True
+                    self._thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, write):
+        entry = _PendingWrite(write)
+        self._get_queue().put(entry)
+        entry.done.wait()
+        if entry.error is not None:
+            raise entry.error
+
+    def _run(self, queue):
+        while True:
+            entry = queue.get()
+            if entry is _STOP:
+                return
+            batch = [entry]
+            stopping = self._collect(queue, batch)
+            try:
+                errors = self.execute_batch([entry.write for entry in batch])
+            except Exception as e:
+                errors = [e] * len(batch)
+            for entry, error in zip(batch, errors):
+                if error is not None:
+                    self.counters.incr('write_errors')
+                    entry.error = error
+            self.counters.incr('batches')
+            self.counters.incr('writes', len(batch))
+            for entry in batch:
+                entry.done.set()
+            if stopping:
+                return
+
+    def _collect(self, queue, batch):
+        """Add writes submitted within the window to `batch`; return whether
+        the writer was closed meanwhile."""
+        deadline = time.time() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                # writes already queued join without waiting
+                entry = queue.get_nowait()
+            except Empty:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = queue.get(timeout=remaining)
+                except Empty:
+                    break
+            if entry is _STOP:
+                return True
+            batch.append(entry)
+        return False
+
+    def wait(self, sid, timeout=None):
+        # saves only return once their writes are stored
+        return True
+
+    def flush(self, timeout=None):
+        return True
+
+    def close(self, timeout=None):
+        """Stop the committer thread, after it sends what is queued."""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._pid = None
+
+
+class _PendingWrite(object):
+    __slots__ = ('write', 'done', 'error')
+
+    def __init__(self, write):
+        self.write = write
+        self.done = threading.Event()
+        self.error = None
@@ -19,7 +19,17 @@ _M._VERSION = '0.1.1-2'
 local ck = require "resty.cookie"
 local redis = require "resty.redis"
 
-function _M.new(self, redis_conn, cookie_name, redis_prefix)
+-- `opts` is optional:
+--   opts.hash_tags: set when the Flask application uses
+--                   `SESSION_KEY_HASH_TAGS`, i.e. session keys look like
+--                   "<prefix>:signature:{<sid>}"
+--   opts.read_conn: a connection to a replica that signatures and groups
+--                   are read from, unless the client recently wrote to its
+--                   session (the "<cookie_name>_primary" cookie is set)
+--   opts.auth_record: set when the Flask application uses
+--                   `SESSION_AUTH_RECORD`; signatures and group memberships
+--                   are then looked up in the "<prefix>:auth:<sid>" hash
+function _M.new(self, redis_conn, cookie_name, redis_prefix, opts)
     local cookie, err = ck:new()
     if not cookie then
         return nil, err
@@ -42,13 +52,28 @@ function _M.new(self, redis_conn, cookie_name, redis_prefix)
 
     local _sid = string.sub(sess_cookie, 0, 36)
     local _signature = string.sub(sess_cookie, 38, -1)
+    local _key_sid = _sid
+    if opts and opts.hash_tags then
+        _key_sid = "{" .. _sid .. "}"
+    end
+
+    local read_conn = nil
+    if opts and opts.read_conn then
+        local sticky = cookie:get(cookie_name .. "_primary")
+        if not sticky then
+            read_conn = opts.read_conn
+        end
+    end
 
     return setmetatable({
         _redis_conn=redis_conn,
+        _read_conn=read_conn,
         _session_cookie=sess_cookie,
         _sid = _sid,
+        _key_sid = _key_sid,
         _signature = _signature,
         _redis_prefix = redis_prefix,
+        _auth_record = opts and opts.auth_record or false,
         _verified = false,
         _data = nil
     }, {__index = self })
@@ -63,9 +88,46 @@ local function get_redis_groups_key(prefix, sid)
     return prefix .. ":groups:" .. sid
 end
 
+local function get_redis_auth_key(prefix, sid)
+    return prefix .. ":auth:" .. sid
+end
+
+local function get_redis_group_version_key(prefix, group)
+    return prefix .. ":group_version:" .. group
+end
+
+-- the auth record field holding the signature; the others are group ids
+local AUTH_SIGNATURE_FIELD = ""
+
+local function is_missing(res)
+    if res == ngx.null then
+        return true
+    end
+    -- an empty set, or an HMGET whose first field (the signature) is unset
+    return type(res) == "table" and (#res == 0 or res[1] == ngx.null)
+end
+
+-- runs `cmd` on the replica if there is one, and again on the primary if
+-- the replica doesn't have the key yet (e.g. a session created moments ago)
+local function read(self, cmd, ...)
+    if self._read_conn then
+        local res, err = self._read_conn[cmd](self._read_conn, ...)
+        if res and not is_missing(res) then
+            return res, err
+        end
+    end
+    return self._redis_conn[cmd](self._redis_conn, ...)
+end
+
 function _M.verify_signature(self)
-    local key = get_redis_signature_key(self._redis_prefix, self._sid)
-    local actual_sig, err = self._redis_conn:get(key)
+    local actual_sig, err
+    if self._auth_record then
+        local key = get_redis_auth_key(self._redis_prefix, self._key_sid)
+        actual_sig, err = read(self, "hget", key, AUTH_SIGNATURE_FIELD)
+    else
+        local key = get_redis_signature_key(self._redis_prefix, self._key_sid)
+        actual_sig, err = read(self, "get", key)
+    end
     if not actual_sig then
         ngx.log(ngx.ERR, err)
         return nil, err
@@ -93,12 +155,23 @@ function _M.get_cookie_raw(self)
 end
 
 function _M.list_allowed_groups(self)
-    local key = get_redis_groups_key(self._redis_prefix, self._sid)
-    local data, err = self._redis_conn:smembers(key)
+    local key = get_redis_groups_key(self._redis_prefix, self._key_sid)
+    local data, err = read(self, "smembers", key)
     return data, err
 end
 
 function _M.is_group_member(self, group)
+    if self._auth_record then
+        local key = get_redis_auth_key(self._redis_prefix, self._key_sid)
+        local res, err = read(self, "hexists", key, group)
+        if not res then
+            return nil, err
+        end
+        if res == 1 and group ~= AUTH_SIGNATURE_FIELD then
+            return true, nil
+        end
+        return nil, "not allowed"
+    end
     local allowed, err = self:list_allowed_groups()
     if not allowed then
         return nil, err
@@ -111,5 +184,47 @@ function _M.is_group_member(self, group)
     return nil, "not allowed"
 end
 
+-- verify_signature and is_group_member in one go; with `opts.auth_record`
+-- this is a single HMGET
+function _M.authorize(self, group)
+    if not self._auth_record then
+        local ok, err = self:verify_signature()
+        if not ok then
+            return nil, err
+        end
+        return self:is_group_member(group)
+    end
+    if group == AUTH_SIGNATURE_FIELD then
+        return nil, "not allowed"
+    end
+    local key = get_redis_auth_key(self._redis_prefix, self._key_sid)
+    local res, err = read(self, "hmget", key, AUTH_SIGNATURE_FIELD, group)
+    if not res then
+        ngx.log(ngx.ERR, err)
+        return nil, err
+    end
+    if res[1] == ngx.null or tostring(res[1]) ~= self._signature then
+        return nil, "signatures did not match!"
+    end
+    if res[2] == ngx.null then
+        return nil, "not allowed"
+    end
+    return true, nil
+end
+
+-- `base_key` with the group's current version appended, e.g. for use in
+-- proxy_cache_key; matches GroupVersions.cache_key on the Flask side
+function _M.versioned_cache_key(self, group, base_key)
+    local key = get_redis_group_version_key(self._redis_prefix, group)
+    local version, err = read(self, "get", key)
+    if not version then
+        return nil, err
+    end
+    if version == ngx.null then
+        version = "0"
+    end
+    return base_key .. ":v" .. version, nil
+end
+
 return _M
 
@@ -1,3 +1,4 @@
+import os
 import redis
 import logging.config
 
@@ -8,6 +9,10 @@ class Configurator(object):
     REDIS_SESSION_DB = 12
     SESSION_COOKIE_NAME = 'app_session_cookie'
     CACHE_TIMEOUT_SECS = 3
+    # synthetic users for load_test; 0 disables them
+    LOAD_TEST_GROUPS = int(os.environ.get('TESTAPP_LOAD_TEST_GROUPS', 0))
+    LOAD_TEST_GROUPS_PER_USER = int(
+        os.environ.get('TESTAPP_LOAD_TEST_GROUPS_PER_USER', 3))
 
 CONFIG = Configurator()
 
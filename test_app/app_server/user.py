@@ -1,3 +1,5 @@
+import re
+from .config import CONFIG
 from .errors import UserNotFound, BadPassword, LoginError, Unauthorized
 
 USER_FIXTURES = (
@@ -9,6 +11,31 @@ USER_FIXTURES = (
 
 USER_FIXTURES_BY_EMAIL = {u['email']: u for u in USER_FIXTURES}
 
+LOAD_TEST_EMAIL_RE = re.compile(r'^load-user-(\d+)@example\.com$')
+
+
+def load_test_user_fixture(index):
+    """Synthetic user number `index`, for load tests.  Users are spread
+    evenly over CONFIG.LOAD_TEST_GROUPS groups, with
+    CONFIG.LOAD_TEST_GROUPS_PER_USER groups each."""
+    group_count = CONFIG.LOAD_TEST_GROUPS
+    per_user = min(CONFIG.LOAD_TEST_GROUPS_PER_USER, group_count)
+    return {
+        'email': 'load-user-%i@example.com' % index,
+        'password': 'load-user-%i' % index,
+        'groups': tuple('load-group-%i' % ((index * per_user + i) % group_count)
+                        for i in range(per_user))
+    }
+
+
+def find_user_fixture(email):
+    user_data = USER_FIXTURES_BY_EMAIL.get(email)
+    if user_data is None and CONFIG.LOAD_TEST_GROUPS:
+        match = LOAD_TEST_EMAIL_RE.match(email)
+        if match:
+            user_data = load_test_user_fixture(int(match.group(1)))
+    return user_data
+
 class User(object):
     def __init__(self, email, password, groups=None):
         self.email = email
@@ -17,7 +44,7 @@ class User(object):
 
     @classmethod
     def by_email(cls, email):
-        user_data = USER_FIXTURES_BY_EMAIL.get(email)
+        user_data = find_user_fixture(email)
         if user_data is None:
             raise UserNotFound(email)
         assert user_data['email'] == email
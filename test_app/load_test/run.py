@@ -0,0 +1,406 @@
+"""Load test for the example application: simulates thousands of users
+spread over many groups, each logging in, reading cacheable and uncacheable
+resources of its groups (plus some of other groups, which must be refused)
+and logging out.
+
+    python -m load_test.run [--target flask|http://host:port] [--users N]
+        [--concurrency N] [--requests-per-user N] [--groups N]
+        [--groups-per-user N] [--resources N] [--mix KIND=WEIGHT ...]
+        [--redis-url URL] [--set SESSION_OPTION=VALUE ...] [--output FILE]
+
+With ``--target flask`` (the default) the app runs in-process behind
+Flask's test client, against ``--redis-url`` or a throwaway redislite
+server, and ``--set`` changes its session config.  Any other target is a
+base URL: the Flask server itself (port 5017) or OpenResty in front of it
+(port 8089).  The app server must then run with TESTAPP_LOAD_TEST_GROUPS
+(and TESTAPP_LOAD_TEST_GROUPS_PER_USER) matching ``--groups`` (and
+``--groups-per-user``) so that it knows the simulated users;
+scripts/run-load-test.sh takes care of that.
+
+Reported: requests/sec, latency percentiles per kind of request, Redis
+commands per request (from INFO on ``--redis-url``, which should be the
+session Redis), nginx's cache hit ratio for cacheable resources (from the
+X-Cache-Status header) and, in-process, the session cache's hit ratio.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+from app_server.config import CONFIG, session_redis
+from app_server.user import load_test_user_fixture
+
+APP_BASE = '/app'
+API_BASE = '%s/api/v1' % APP_BASE
+
+DEFAULT_MIX = {'cacheable': 6, 'uncacheable': 3, 'forbidden': 1}
+KINDS = ('login', 'cacheable', 'uncacheable', 'forbidden', 'logout')
+EXPECTED_STATUS = {
+    'login': 302,
+    'cacheable': 200,
+    'uncacheable': 200,
+    'forbidden': 403,
+    'logout': 302,
+}
+
+
+class FlaskTarget(object):
+    """The app, in this process."""
+
+    def __init__(self, redis, session_config):
+        from flask_resty_shared_session import RestySharedSession
+        from app_server.application import app
+        app.config['SESSION_REDIS'] = redis
+        app.config.update(session_config)
+        RestySharedSession(app)
+        self.app = app
+
+    def client(self):
+        return FlaskClient(self.app.test_client())
+
+    def session_cache_stats(self):
+        cache = self.app.session_interface.cache
+        return cache.stats() if cache is not None else None
+
+
+class FlaskClient(object):
+
+    def __init__(self, client):
+        self._client = client
+
+    def request(self, method, path, data=None):
+        response = self._client.open(path, method=method, data=data)
+        return response.status_code, response.headers.get('X-Cache-Status')
+
+
+class HTTPTarget(object):
+    """A running app server, or OpenResty in front of one."""
+
+    def __init__(self, base_url):
+        import requests
+        self._requests = requests
+        self.base_url = base_url.rstrip('/')
+
+    def client(self):
+        return HTTPClient(self.base_url, self._requests.Session())
+
+    def session_cache_stats(self):
+        return None
+
+
+class HTTPClient(object):
+
+    def __init__(self, base_url, session):
+        self._base_url = base_url
+        self._session = session
+
+    def request(self, method, path, data=None):
+        response = self._session.request(method, self._base_url + path,
+                                         data=data, allow_redirects=False)
+        return response.status_code, response.headers.get('X-Cache-Status')
+
+
+class Stats(object):
+    """What one load-generating thread saw; merged at the end."""
+
+    def __init__(self):
+        self.latencies = dict((kind, []) for kind in KINDS)
+        self.errors = dict((kind, 0) for kind in KINDS)
+        self.cache_statuses = {}
+
+    def record(self, kind, seconds, ok, cache_status):
+        self.latencies[kind].append(seconds)
+        if not ok:
+            self.errors[kind] += 1
+        if cache_status is not None:
+            self.cache_statuses[cache_status] = \
+                self.cache_statuses.get(cache_status, 0) + 1
+
+    def merge(self, other):
+        for kind in KINDS:
+            self.latencies[kind].extend(other.latencies[kind])
+            self.errors[kind] += other.errors[kind]
+        for status, count in other.cache_statuses.items():
+            self.cache_statuses[status] = \
+                self.cache_statuses.get(status, 0) + count
+
+
+class LoadTest(object):
+
+    def __init__(self, target, users, concurrency, requests_per_user,
+                 group_count, resources, mix, seed=0):
+        self.target = target
+        self.users = users
+        self.concurrency = concurrency
+        self.requests_per_user = requests_per_user
+        self.group_count = group_count
+        self.resources = resources
+        self.mix = sorted(mix.items())
+        self.seed = seed
+        self._next_user = iter(range(users))
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Simulate every user; returns the merged :class:`Stats` and the
+        elapsed time."""
+        thread_stats = [Stats() for _ in range(self.concurrency)]
+        threads = [threading.Thread(target=self._work, args=(stats,))
+                   for stats in thread_stats]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+        stats = Stats()
+        for other in thread_stats:
+            stats.merge(other)
+        return stats, elapsed
+
+    def _work(self, stats):
+        while True:
+            with self._lock:
+                index = next(self._next_user, None)
+            if index is None:
+                return
+            self.simulate_user(index, stats)
+
+    def simulate_user(self, index, stats):
+        user = load_test_user_fixture(index)
+        rng = random.Random(self.seed * 1000003 + index)
+        client = self.target.client()
+        self._call(stats, client, 'login', 'POST', '%s/login' % APP_BASE,
+                   {'email': user['email'], 'password': user['password']})
+        for _ in range(self.requests_per_user):
+            kind = self._choose_kind(rng)
+            group_id = rng.choice(user['groups'])
+            if kind == 'forbidden':
+                group_id = self._other_group(rng, user['groups'])
+                if group_id is None:
+                    kind = 'uncacheable'
+                    group_id = rng.choice(user['groups'])
+            # forbidden requests ask for cacheable resources, so that they
+            # also exercise the nginx-side group check
+            cacheability = 'uncacheable' if kind == 'uncacheable' \
+                else 'cacheable'
+            path = '%s/group/%s/%s/resource-%i' % (
+                API_BASE, group_id, cacheability,
+                rng.randrange(self.resources))
+            self._call(stats, client, kind, 'GET', path)
+        self._call(stats, client, 'logout', 'POST', '%s/logout' % APP_BASE)
+
+    def _choose_kind(self, rng):
+        point = rng.uniform(0, sum(weight for _, weight in self.mix))
+        for kind, weight in self.mix:
+            point -= weight
+            if point <= 0:
+                return kind
+        return self.mix[-1][0]
+
+    def _other_group(self, rng, groups):
+        if len(groups) >= self.group_count:
+            return None
+        while True:
+            group_id = 'load-group-%i' % rng.randrange(self.group_count)
+            if group_id not in groups:
+                return group_id
+
+    def _call(self, stats, client, kind, method, path, data=None):
+        started = time.time()
+        try:
+            status, cache_status = client.request(method, path, data)
+        except Exception:
+            status, cache_status = None, None
+        stats.record(kind, time.time() - started,
+                     status == EXPECTED_STATUS[kind],
+                     cache_status if kind == 'cacheable' else None)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def commands_processed(redis):
+    try:
+        return int(redis.info('stats')['total_commands_processed'])
+    except Exception:
+        return None
+
+
+def summarize(stats, elapsed, commands, session_cache_stats):
+    rows = []
+    total = 0
+    for kind in KINDS:
+        latencies = sorted(stats.latencies[kind])
+        total += len(latencies)
+        if not latencies:
+            continue
+        rows.append({
+            'kind': kind,
+            'requests': len(latencies),
+            'errors': stats.errors[kind],
+            'p50_ms': percentile(latencies, 0.50) * 1e3,
+            'p90_ms': percentile(latencies, 0.90) * 1e3,
+            'p99_ms': percentile(latencies, 0.99) * 1e3,
+            'max_ms': latencies[-1] * 1e3,
+        })
+    summary = {
+        'requests': total,
+        'errors': sum(stats.errors.values()),
+        'elapsed_sec': elapsed,
+        'requests_per_sec': total / elapsed if elapsed else 0.0,
+        'redis_commands_per_request':
+            float(commands) / total if commands is not None and total
+            else None,
+        'cache_statuses': stats.cache_statuses,
+        'cache_hit_ratio': None,
+        'session_cache_hit_ratio': None,
+    }
+    cached = sum(stats.cache_statuses.values())
+    if cached:
+        summary['cache_hit_ratio'] = \
+            float(stats.cache_statuses.get('HIT', 0)) / cached
+    if session_cache_stats:
+        lookups = session_cache_stats.get('hits', 0) + \
+            session_cache_stats.get('misses', 0)
+        if lookups:
+            summary['session_cache_hit_ratio'] = \
+                float(session_cache_stats.get('hits', 0)) / lookups
+    return summary, rows
+
+
+def print_table(rows, columns):
+    lines = [list(columns)]
+    for row in rows:
+        cells = []
+        for col in columns:
+            value = row.get(col, '')
+            if value is None:
+                value = '-'
+            elif isinstance(value, float):
+                value = '%.2f' % value
+            cells.append(str(value))
+        lines.append(cells)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(columns))]
+    for line in lines:
+        print('  '.join(cell.rjust(width) for cell, width in zip(line, widths)))
+
+
+def parse_option(text):
+    name, _, value = text.partition('=')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return name, value
+
+
+def make_redis(url):
+    if url is not None:
+        from redis import StrictRedis
+        return StrictRedis.from_url(url)
+    try:
+        import redislite
+    except ImportError:
+        return session_redis()
+    import os
+    import tempfile
+    return redislite.StrictRedis(os.path.join(
+        tempfile.mkdtemp(prefix='testapp_load'), 'load.db'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--target', default='flask')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests-per-user', type=int, default=10)
+    parser.add_argument('--groups', type=int,
+                        default=CONFIG.LOAD_TEST_GROUPS or 200)
+    parser.add_argument('--groups-per-user', type=int,
+                        default=CONFIG.LOAD_TEST_GROUPS_PER_USER)
+    parser.add_argument('--resources', type=int, default=20,
+                        help='distinct resource ids per group')
+    parser.add_argument('--mix', action='append', default=[],
+                        metavar='KIND=WEIGHT',
+                        help='relative weight of cacheable, uncacheable or '
+                             'forbidden requests')
+    parser.add_argument('--redis-url',
+                        help='the session Redis (default: a redislite '
+                             'server in-process, the app config over HTTP)')
+    parser.add_argument('--set', dest='options', action='append', default=[],
+                        metavar='SESSION_OPTION=VALUE',
+                        help='extra app config for --target flask')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    CONFIG.LOAD_TEST_GROUPS = args.groups
+    CONFIG.LOAD_TEST_GROUPS_PER_USER = args.groups_per_user
+    mix = dict(DEFAULT_MIX)
+    for option in args.mix:
+        kind, weight = parse_option(option)
+        if kind not in mix:
+            parser.error('unknown request kind %r' % kind)
+        mix[kind] = float(weight)
+    session_config = dict(parse_option(o) for o in args.options)
+
+    if args.target == 'flask':
+        redis = make_redis(args.redis_url)
+        target = FlaskTarget(redis, session_config)
+    else:
+        if session_config:
+            parser.error('--set only applies to --target flask')
+        redis = make_redis(args.redis_url) if args.redis_url \
+            else session_redis()
+        target = HTTPTarget(args.target)
+
+    load_test = LoadTest(target, args.users, args.concurrency,
+                         args.requests_per_user, args.groups, args.resources,
+                         mix, args.seed)
+    before = commands_processed(redis)
+    stats, elapsed = load_test.run()
+    after = commands_processed(redis)
+    commands = None
+    if before is not None and after is not None:
+        # minus the INFO that took `after`
+        commands = after - before - 1
+    summary, rows = summarize(stats, elapsed, commands,
+                              target.session_cache_stats())
+
+    print_table(rows, ['kind', 'requests', 'errors', 'p50_ms', 'p90_ms',
+                       'p99_ms', 'max_ms'])
+    print()
+    print_table([summary], ['requests', 'errors', 'requests_per_sec',
+                            'redis_commands_per_request', 'cache_hit_ratio',
+                            'session_cache_hit_ratio'])
+    if args.output:
+        document = {
+            'meta': {
+                'target': args.target,
+                'users': args.users,
+                'concurrency': args.concurrency,
+                'requests_per_user': args.requests_per_user,
+                'groups': args.groups,
+                'groups_per_user': args.groups_per_user,
+                'resources': args.resources,
+                'mix': mix,
+                'session_config': session_config,
+            },
+            'summary': summary,
+            'kinds': rows,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+#!/bin/bash
+
+. $(dirname ${BASH_SOURCE[0]})/common.sh
+
+# runs load_test against OpenResty in front of the Flask server;
+# arguments are passed on, e.g. --users 5000 --concurrency 32.
+# for the Flask app alone and in-process, run `python -m load_test.run`.
+
+function run-load-test() {
+    pushd ${TESTAPP_ROOT_DIR}
+    local tmp_dir="${TESTAPP_ROOT_DIR}/tmp"
+    local test_logs_dir="${tmp_dir}/test_logs"
+    mkdir -p ${test_logs_dir}
+    local resty_log="${test_logs_dir}/load_resty.log"
+    local flask_log="${test_logs_dir}/load_flask.log"
+
+    echo "flask will log to ${flask_log}" >&2
+    echo "resty will log to ${resty_log}" >&2
+
+    local scripts=${TESTAPP_SCRIPTS_DIR}
+    export PYTHONUNBUFFERED="Yay"
+    export PYTHONPATH="${PYTHONPATH}:$(pwd)"
+    # the app server has to know the simulated users
+    export TESTAPP_LOAD_TEST_GROUPS=${TESTAPP_LOAD_TEST_GROUPS:-200}
+    export TESTAPP_LOAD_TEST_GROUPS_PER_USER=${TESTAPP_LOAD_TEST_GROUPS_PER_USER:-3}
+    trap "trap - SIGTERM && kill -- -$$" SIGINT SIGTERM SIGKILL EXIT
+
+    ${scripts}/run-app.sh &> ${flask_log} &
+    local app_pid="$!"
+    ${scripts}/run-resty.sh &> ${resty_log} &
+    local resty_pid="$!"
+
+    sleep 1
+    python -m load_test.run --target http://localhost:8089 "$@"
+    local status="$?"
+
+    kill -9 ${app_pid}
+    kill -9 ${resty_pid}
+    wait
+    popd
+    return ${status}
+}
+
+run-load-test "$@"